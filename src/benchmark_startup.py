@@ -0,0 +1,102 @@
+"""
+Measures the startup (import) time of the entry points of the code and guards against startup regressions: the entry
+ points which are used by every run (main.py and the model/retriever loaders) must not import any of the heavy
+ backend dependencies, which are only imported once a backend is selected (see model/models/loader.py and
+ model/retrievers/loader.py).
+
+Each import is measured in a fresh interpreter, so the results are not affected by the modules cached in this process.
+
+How to use:
+    python benchmark_startup.py [--repeats 5] [--max-seconds 2.0] [--backends] [--output startup.json]
+The script exits with a non-zero status if a light entry point imports a heavy dependency or takes longer than
+ --max-seconds to import.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HEAVY_MODULES = ["torch", "transformers", "haystack", "pyserini", "openai", "spel"]
+
+LIGHT_ENTRY_POINTS = {
+    "main": "import main",
+    "llm_loader": "from model.models.loader import get_llm",
+    "retriever_loader": "from model.retrievers.loader import get_retriever",
+}
+
+MEASURE_TEMPLATE = """
+import sys, time, json
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{"seconds": elapsed, "heavy_modules": heavy}}))
+"""
+
+
+def measure(statement, repeats):
+    """
+    imports the statement in repeats fresh interpreters and returns the median import time and the heavy modules it
+     imported; None is returned if the statement cannot be imported in this environment.
+    """
+    code = MEASURE_TEMPLATE.format(statement=statement, heavy=HEAVY_MODULES)
+    src_directory = os.path.dirname(os.path.abspath(__file__))
+    timings, heavy_modules = [], []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", code], cwd=src_directory, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed"
+        measurement = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(measurement["seconds"])
+        heavy_modules = measurement["heavy_modules"]
+    return {"seconds": statistics.median(timings), "heavy_modules": heavy_modules}, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark of the entry points.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="maximum allowed median import time of each light entry point")
+    parser.add_argument("--backends", action="store_true",
+                        help="also report the import time of each registered LLM and retriever backend")
+    parser.add_argument("--output", default=None, help="optional path of a JSON file to store the results in")
+    args = parser.parse_args()
+
+    entry_points = dict(LIGHT_ENTRY_POINTS)
+    if args.backends:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from model.models.loader import LLM_REGISTRY
+        from model.retrievers.loader import RETRIEVER_REGISTRY
+        for name, (module_name, class_name) in list(LLM_REGISTRY.items()) + list(RETRIEVER_REGISTRY.items()):
+            entry_points[f"backend:{name}"] = f"from {module_name} import {class_name}"
+
+    results, failures = {}, []
+    for name, statement in entry_points.items():
+        measurement, error = measure(statement, args.repeats)
+        if measurement is None:
+            print(f"{name:<28} unavailable ({error})")
+            results[name] = {"error": error}
+            if name in LIGHT_ENTRY_POINTS:
+                failures.append(f"{name} could not be imported")
+            continue
+        results[name] = measurement
+        print(f"{name:<28} {measurement['seconds'] * 1000:9.1f} ms   heavy modules: "
+              f"{', '.join(measurement['heavy_modules']) or '-'}")
+        if name in LIGHT_ENTRY_POINTS:
+            if measurement["heavy_modules"]:
+                failures.append(f"{name} imports {', '.join(measurement['heavy_modules'])}")
+            if args.max_seconds is not None and measurement["seconds"] > args.max_seconds:
+                failures.append(f"{name} took {measurement['seconds']:.2f}s (> {args.max_seconds:.2f}s)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from typing import Callable, Optional
 
-from data.loaders.utils import QADataset
+from data.loaders.utils import QADataset, ShardedDataset
 from data.loaders.sqa import StrategyQA
 from data.loaders.fqa import FactoidQA
 from data.loaders.eqs import EntityQuestions
@@ -8,13 +8,17 @@ from data.loaders.eqs import EntityQuestions
 def get_dataset(config) -> QADataset:
     dataset_name = config['Dataset']['name']
     if dataset_name == "FACTOIDQA":
-        return FactoidQA(config)
+        dataset = FactoidQA(config)
     elif dataset_name == "STRATEGYQA":
-        return StrategyQA(config)
+        dataset = StrategyQA(config)
     elif dataset_name == "EntityQuestions":
-        return EntityQuestions(config)
+        dataset = EntityQuestions(config)
     else:
         raise ValueError(f"Unknown dataset: {dataset_name}")
+    if 'shard_id' in config['Experiment']:
+        # the annotation worker of one shard in a multi-process run (see main.py)
+        return ShardedDataset(dataset, int(config['Experiment']['num_shards']), int(config['Experiment']['shard_id']))
+    return dataset
 
 def ralm_qa_prompt(question, context: list=None) -> str:
     if not context or len(context) == 0:
@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 import requests
 from typing import Optional, Iterable
 from dataclasses import dataclass
@@ -30,6 +31,24 @@ class QADataset(Iterable):
             question = question + "?"
         return question[0].lower() + question[1:]
 
+def question_shard(question: str, num_shards: int) -> int:
+    """Assigns a question to one of num_shards shards using a hash which is stable across processes and runs."""
+    return int.from_bytes(hashlib.blake2b(question.encode('utf-8'), digest_size=8).digest(), 'little') % num_shards
+
+class ShardedDataset(QADataset):
+    """Iterates over the records of the wrapped dataset whose questions are assigned to shard_id."""
+    def __init__(self, dataset: QADataset, num_shards: int, shard_id: int):
+        if not 0 <= shard_id < num_shards:
+            raise ValueError(f"Invalid shard id {shard_id} for {num_shards} shards")
+        self.dataset = dataset
+        self.num_shards = num_shards
+        self.shard_id = shard_id
+
+    def __iter__(self):
+        for record in self.dataset:
+            if question_shard(record.question, self.num_shards) == self.shard_id:
+                yield record
+
 @dataclass
 class QARecord:
     question: str
@@ -1,15 +1,47 @@
 
+import os
+import json
+from collections import Counter
+
+from data.loaders.utils import question_shard
+
+
 class StoreResult:
     """
-    Stores the annotated datarecords as a jsonl file
+    Stores the annotated datarecords as a jsonl file.
+    The records are written in batches of Experiment.flush_interval records. With Experiment.resume set, the records
+     of an existing output file are kept, the questions already annotated in it are skipped (see skip_completed) and
+     the new records are appended to it.
     """
     def __init__(self, config) -> None:
+        self.path = self.output_path(config)
+        if 'shard_id' in config['Experiment']:
+            self.path = self.shard_path(self.path, int(config['Experiment']['shard_id']),
+                                        int(config['Experiment']['num_shards']))
+        self.flush_interval = max(1, int(config['Experiment'].get('flush_interval', '100')))
+        self.buffer = []
+        self.completed = Counter()
+        self.resumed_predictions = []
+        resume = config['Experiment'].get('resume', 'False').lower() == 'true'
+        if resume and os.path.exists(self.path):
+            self._load_completed()
+            self.out = open(self.path, 'a', encoding='utf-8')
+        else:
+            self.out = open(self.path, 'w', encoding='utf-8')
+
+    @staticmethod
+    def output_path(config):
         dataset_name = config['Dataset']['name'].lower()
         model_type = config['Model']['name'].lower()
         dataset_split = config['Dataset']['split'].lower()
+        retriever_type = config["Model.Retriever"]["type"]
+        if retriever_type.lower() == 'cascade':
+            # e.g. cascade-spel100-bm25100 for cascade_tiers = spel:100, bm25:100
+            tiers = [x.strip().replace(':', '') for x in config["Model.Retriever"].get("cascade_tiers", "").split(',')]
+            fill_up = '-fill' if config["Model.Retriever"].get("cascade_fill_up", "False").lower() == 'true' else ''
+            retriever_type = "-".join(["cascade"] + [x for x in tiers if x]) + fill_up
         if model_type == 'hfllm' or model_type == 'hfllama':
             hf_model_name = config["Model"]["hf_model_name"].split("/")[-1]
-            retriever_type = config["Model.Retriever"]["type"]
             quantized = config["Model"]["hf_llm_load_in_8bit"].lower() == 'true'
             top_k = config["Model.Retriever"]["retriever_top_k"]
             max_gen = config["Model"]["hf_max_tokens_to_generate"]
@@ -19,7 +51,6 @@ class StoreResult:
             experiment_desc =experiment_desc + f'_{hf_model_name}{qant}_max_gen_{max_gen}'
         elif model_type == 'replug':
             hf_model_name = config["Model"]["hf_model_name"].split("/")[-1]
-            retriever_type = config["Model.Retriever"]["type"]
             top_k = config["Model.Retriever"]["retriever_top_k"]
             quantized = config["Model"]["hf_llm_load_in_8bit"].lower() == 'true'
             max_gen = config["Model"]["hf_max_tokens_to_generate"]
@@ -29,11 +60,88 @@ class StoreResult:
             experiment_desc =experiment_desc + f'_{hf_model_name}{qant}_max_gen_{max_gen}'
         else:
             experiment_desc = (config['Experiment']['name']).replace(' ', '_').lower()
-        self.out = open(f"{dataset_name}_{dataset_split}_{model_type}_{experiment_desc}.jsonl", 'w', encoding='utf-8')
+        file_name = f"{dataset_name}_{dataset_split}_{model_type}_{experiment_desc}.jsonl"
+        output_dir = config['Experiment'].get('output_dir', '')
+        return os.path.join(output_dir, file_name) if output_dir else file_name
+
+    @staticmethod
+    def shard_path(path, shard_id, num_shards):
+        return f"{path}.part-{shard_id}-of-{num_shards}"
+
+    @staticmethod
+    def merge_shards(path, num_shards, dataset):
+        """
+        merges the part files of the num_shards shards into path in the order of the records in the (unsharded) dataset
+         and removes the part files.
+        """
+        part_paths = [StoreResult.shard_path(path, shard_id, num_shards) for shard_id in range(num_shards)]
+        parts = [open(part_path, 'r', encoding='utf-8') for part_path in part_paths]
+        try:
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as out:
+                for record in dataset:
+                    shard_id = question_shard(record.question, num_shards)
+                    line = parts[shard_id].readline()
+                    if not line or json.loads(line)['question'] != record.question:
+                        raise ValueError(f"{part_paths[shard_id]} does not match the dataset at question: {record.question}")
+                    out.write(line)
+            for part, part_path in zip(parts, part_paths):
+                if part.readline():
+                    raise ValueError(f"{part_path} contains records which are not in the dataset")
+        finally:
+            for part in parts:
+                part.close()
+        os.replace(f"{path}.tmp", path)
+        for part_path in part_paths:
+            os.remove(part_path)
+
+    def _load_completed(self):
+        """
+        reads the questions annotated in the existing output file; a partially written last line (e.g. the run was
+         killed during a write) is truncated away.
+        """
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        complete_length = content.rfind(b'\n') + 1
+        if complete_length < len(content):
+            with open(self.path, 'r+b') as f:
+                f.truncate(complete_length)
+        for line in content[:complete_length].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            annotated_record = json.loads(line)
+            self.completed[annotated_record['question']] += 1
+            self.resumed_predictions.append(
+                (annotated_record['question'], annotated_record['answer_aliases'], annotated_record['predicted_answer']))
+        print(f"Resuming {self.path} with {len(self.resumed_predictions)} already annotated records!")
+
+    def skip_completed(self, dataset):
+        """
+        yields the records of the dataset which are not annotated in the output file yet; a question appearing n times
+         in the output file skips its first n occurrences in the dataset.
+        """
+        for record in dataset:
+            if self.completed[record.question] > 0:
+                self.completed[record.question] -= 1
+                continue
+            yield record
 
     def store(self, record):
         # TODO log the question, answer and the ground truth in here!
-        self.out.write(f"{str(record)}\n")
+        self.buffer.append(f"{str(record)}\n")
+        if len(self.buffer) >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.out.write("".join(self.buffer))
+            self.buffer = []
+        self.out.flush()
+
+    def close(self):
+        if not self.out.closed:
+            self.flush()
+            self.out.close()
 
     def __del__(self):
-        self.out.close()
\ No newline at end of file
+        if hasattr(self, 'out'):
+            self.close()
\ No newline at end of file
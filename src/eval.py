@@ -1,57 +1,106 @@
 from typing import List
+from collections import Counter
 import os
 import json
-import numpy as np
 from tqdm import tqdm
-from sklearn.metrics import accuracy_score, recall_score, f1_score
 from oqaeval.eval import em_eval, f1_eval # pip install git+https://github.com/ehsk/OpenQA-eval.git
 from oqaeval.data_utils import Question
 from oqaeval.squad_evaluate import metric_max_over_ground_truths, normalize_answer
 
 class EvaluationMetrics:
-    def __init__(self, config, dataset, split):
+    """
+    Keeps running sums of the evaluation metrics so that the scores are available at any point in O(1) through
+     snapshot(). The per-prediction details (expected_answers, model_answers and open_domain_predictions) are only
+     retained when keep_predictions is set.
+    """
+    def __init__(self, config, dataset, split, keep_predictions=False):
         self.evaluate_rouge = config['Evaluate']['evaluate_rouge'].lower() == 'true'
         self.evaluate_bem = config['Evaluate']['evaluate_bem'].lower() == 'true'
         self.split = split
         self.dataset = dataset
         if dataset == 'strategy_qa' and split == 'dev':
             self.split = 'train_filtered (easy)'
+        self.keep_predictions = keep_predictions
         self.expected_answers = []
         self.model_answers = []
         self.open_domain_predictions = []
+        # running sums of the boolean (StrategyQA) predictions
+        self.predictions_count = 0
+        self.correct_count = 0
+        self.invalid_count = 0
+        self.confusion = Counter()
+        # running sums of the open-domain predictions
+        self.open_domain_count = 0
+        self.em_sum = 0.0
+        self.f1_sum = 0.0
 
     def add_predictions(self, expected_answer, model_answer):
-        self.expected_answers.append(expected_answer)
-        self.model_answers.append(model_answer)
+        self.predictions_count += 1
+        self.correct_count += int(expected_answer == model_answer)
+        self.invalid_count += int(model_answer == 'Wrong!')
+        self.confusion[(expected_answer, model_answer)] += 1
+        if self.keep_predictions:
+            self.expected_answers.append(expected_answer)
+            self.model_answers.append(model_answer)
 
     def add_open_domain_prediction(self, question: str, gold_answers: List, candidate_answer: str):
         q = Question(question, gold_answers)
-        self.open_domain_predictions.append({
-            "em": em_eval(q, candidate_answer),
-            "f1": f1_eval(q, candidate_answer),})
+        em, f1 = em_eval(q, candidate_answer), f1_eval(q, candidate_answer)
+        self.open_domain_count += 1
+        self.em_sum += em
+        self.f1_sum += f1
+        if self.keep_predictions:
+            self.open_domain_predictions.append({"em": em, "f1": f1})
+
+    def macro_recall_and_f1(self):
+        """
+        macro-averaged recall and F1 over all the seen labels (identical to sklearn's average='macro' with
+         zero_division=0) computed from the confusion counts.
+        """
+        labels = sorted({label for pair in self.confusion for label in pair})
+        if not labels:
+            return 0.0, 0.0
+        recalls, f1s = [], []
+        for label in labels:
+            tp = self.confusion[(label, label)]
+            fn = sum(c for (e, m), c in self.confusion.items() if e == label and m != label)
+            fp = sum(c for (e, m), c in self.confusion.items() if m == label and e != label)
+            recalls.append(tp / (tp + fn) if tp + fn else 0.0)
+            f1s.append(2 * tp / (2 * tp + fp + fn) if tp + fp + fn else 0.0)
+        return sum(recalls) / len(labels), sum(f1s) / len(labels)
+
+    def snapshot(self):
+        """
+        the current scores as fractions in [0, 1]; the metrics that have not received any predictions are reported 0.
+        """
+        return {
+            'count': self.open_domain_count,
+            'exact_match': self.em_sum / self.open_domain_count if self.open_domain_count else 0.0,
+            'f1': self.f1_sum / self.open_domain_count if self.open_domain_count else 0.0,
+            'predictions_count': self.predictions_count,
+            'accuracy': self.correct_count / self.predictions_count if self.predictions_count else 0.0,
+            'invalid_count': self.invalid_count,
+        }
 
     def print_scores(self):
-        accuracy = accuracy_score(self.expected_answers, self.model_answers)
-        recall = recall_score(self.expected_answers, self.model_answers, average='macro', zero_division=0)
-        f1 = f1_score(self.expected_answers, self.model_answers, average='macro', zero_division=0)
+        accuracy = self.snapshot()['accuracy']
+        recall, f1 = self.macro_recall_and_f1()
         print('\t'+'='*50)
         print(f'\tDataset: {self.dataset}, Split: {self.split}')
         print('\t'+'='*50)
         print('\t==== Accuracy: {:.2f}'.format(accuracy * 100))
         print('\t==== Recall: {:.2f}'.format(recall * 100))
         print('\t==== Macro F1: {:.2f}'.format(f1 * 100))
-        count_na = self.model_answers.count('Wrong!')
-        print(f'\t==== Incorrect answers count: {count_na} out of {len(self.model_answers)}')
+        print(f'\t==== Incorrect answers count: {self.invalid_count} out of {self.predictions_count}')
         print('\t'+'='*50)
 
     def print_open_domain_eval_results(self):
-        exact_match = np.mean([x['em'] for x in self.open_domain_predictions])
-        f1 = np.mean([x['f1'] for x in self.open_domain_predictions])
+        scores = self.snapshot()
         print('\t'+'='*50)
         print(f'\tDataset: {self.dataset}, Split: {self.split}')
         print('\t'+'='*50)
-        print('\t==== Exact Match: {:.2f}'.format(exact_match * 100))
-        print('\t==== F1 Score: {:.2f}'.format(f1 * 100))
+        print('\t==== Exact Match: {:.2f}'.format(scores['exact_match'] * 100))
+        print('\t==== F1 Score: {:.2f}'.format(scores['f1'] * 100))
         print('\t'+'='*50)
 
 class QAEvaluate:
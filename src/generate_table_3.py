@@ -1,7 +1,6 @@
 import numpy as np
 import configparser
 import json
-from sklearn.metrics import accuracy_score
 
 from eval import EvaluationMetrics
 dataset = "StrategyQA"
@@ -47,13 +46,11 @@ def evaluate(filepath, split):
             else:
                 raise ValueError(f"Answer extractor undefined for: {filepath}")
         if dataset == 'StrategyQA':
-            accuracy = accuracy_score(metrics.expected_answers, metrics.model_answers)
-            invalid_count = metrics.model_answers.count('Wrong!')
-            return {'accuracy': accuracy, 'invalid_count': invalid_count, 'exact_match': 'N/A', 'f1': 'N/A'}
+            scores = metrics.snapshot()
+            return {'accuracy': scores['accuracy'], 'invalid_count': scores['invalid_count'], 'exact_match': 'N/A', 'f1': 'N/A'}
         elif dataset == 'FactoidQA':
-            exact_match = np.mean([x['em'] for x in metrics.open_domain_predictions])
-            f1 = np.mean([x['f1'] for x in metrics.open_domain_predictions])
-            return {'accuracy': 'N/A', 'invalid_count': 'N/A', 'exact_match': exact_match, 'f1': f1}
+            scores = metrics.snapshot()
+            return {'accuracy': 'N/A', 'invalid_count': 'N/A', 'exact_match': scores['exact_match'], 'f1': scores['f1']}
 beginnig = """\\begin{table}
 \t\\centering
 \t\\begin{tabular}{l|ll|ll}
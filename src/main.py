@@ -5,22 +5,26 @@ import sys
 import os
 import pathlib
 import configparser
+import multiprocessing
 from tqdm import tqdm
-import numpy as np
 from data.loader import get_dataset
 from data.store import StoreResult
 from model.models.loader import get_llm
 from eval import QAEvaluate, EvaluationMetrics
+from pipeline import AnnotationPipeline, batched
+from model.tracing import TRACER
 
 sys.path.append("src")
 
 def read_configs_from_args(args):
     config = {}
+    redirects_path = str(pathlib.Path(os.path.abspath(__file__)).parent / 'model' / 'retrievers' / 'wikipedia' / 'wikipedia_redirects.json')
     default_config = {
         'Dataset': {'name': 'FACTOIDQA', 'split': 'dev'}, 
         'Model': {'name': 'HFLLM', 'hf_model_name': 'TinyLlama/TinyLlama-1.1B-step-50K-105b', 'hf_max_tokens_to_generate': '10', 'hf_llm_load_in_8bit': 'False'}, 
-        'Model.Retriever': {'type': 'none', 'retriever_top_k': '4', 'prefetched_k_size': '100', 'load_in_memory': False, 'max_w': 100, 'realtime_retrieve': False},
-        'Experiment': {'name': 'experiment description', 'summarize_results': 'False', 'verbose_logging': 'False', 'perform_annotation': 'False'}, 
+        'Model.Retriever': {'type': 'none', 'retriever_top_k': '4', 'prefetched_k_size': '100', 'load_in_memory': False, 'max_w': 100, 'realtime_retrieve': False, 'entity_linking_cache': 'True', 'entity_linking_quantization': 'none', 'wikipedia_redirects_path': redirects_path, 'cascade_tiers': '', 'cascade_fill_up': 'False'},
+        'Experiment': {'name': 'experiment description', 'summarize_results': 'False', 'verbose_logging': 'False', 'perform_annotation': 'False', 'batch_size': '1', 'pipeline': 'False', 'pipeline_queue_size': '2', 'resume': 'False', 'flush_interval': '100', 'num_shards': '1', 'trace_path': ''}, 
+        'Sweep': {'retriever_types': '', 'prefetched_k_sizes': '', 'retriever_top_ks': '', 'seeds': ''},
         'Evaluate': {'experimental_results_path': '../results/Table1/', 'evaluate_rouge': 'False', 'evaluate_bem': 'False', 'perform_evaluation': 'True'}
         }
     config.update(default_config)
@@ -51,6 +55,16 @@ def read_configs_from_args(args):
                 config['Model.Retriever']['realtime_retrieve'] = value
             elif key == 'max-w':
                 config['Model.Retriever']['max_w'] = value
+            elif key == 'entity-linking-cache':
+                config['Model.Retriever']['entity_linking_cache'] = value
+            elif key == 'entity-linking-quantization':
+                config['Model.Retriever']['entity_linking_quantization'] = value
+            elif key == 'wikipedia-redirects-path':
+                config['Model.Retriever']['wikipedia_redirects_path'] = value
+            elif key == 'cascade-tiers':
+                config['Model.Retriever']['cascade_tiers'] = value
+            elif key == 'cascade-fill-up':
+                config['Model.Retriever']['cascade_fill_up'] = value
             elif key == 'experiment-name':
                 config['Experiment']['name'] = value
             elif key == 'summarize-results':
@@ -59,6 +73,32 @@ def read_configs_from_args(args):
                 config['Experiment']['verbose_logging'] = value
             elif key == 'perform-annotation':
                 config['Experiment']['perform_annotation'] = value
+            elif key == 'batch-size':
+                config['Experiment']['batch_size'] = value
+            elif key == 'pipeline':
+                config['Experiment']['pipeline'] = value
+            elif key == 'pipeline-queue-size':
+                config['Experiment']['pipeline_queue_size'] = value
+            elif key == 'resume':
+                config['Experiment']['resume'] = value
+            elif key == 'flush-interval':
+                config['Experiment']['flush_interval'] = value
+            elif key == 'num-shards':
+                config['Experiment']['num_shards'] = value
+            elif key == 'shard-devices':
+                config['Experiment']['shard_devices'] = value
+            elif key == 'output-dir':
+                config['Experiment']['output_dir'] = value
+            elif key == 'sweep-retriever-types':
+                config['Sweep']['retriever_types'] = value
+            elif key == 'sweep-prefetched-k-sizes':
+                config['Sweep']['prefetched_k_sizes'] = value
+            elif key == 'sweep-retriever-top-ks':
+                config['Sweep']['retriever_top_ks'] = value
+            elif key == 'sweep-seeds':
+                config['Sweep']['seeds'] = value
+            elif key == 'trace-path':
+                config['Experiment']['trace_path'] = value
             elif key == 'experimental-results-path':
                 config['Evaluate']['experimental_results_path'] = value
             elif key == 'evaluate-rouge':
@@ -69,6 +109,185 @@ def read_configs_from_args(args):
                 config['Evaluate']['perform_evaluation'] = value
     return config
 
+def annotate(config, llm=None):
+    dataset = get_dataset(config)
+    output = StoreResult(config)
+    llm = llm if llm is not None else get_llm(config)
+    trace_path = config['Experiment'].get('trace_path', '')
+    if trace_path:
+        TRACER.enable(trace_path)
+    metrics = EvaluationMetrics(config, config['Dataset']['name'], config['Dataset']['split'])
+    summarize = config['Experiment']['summarize_results'].lower() == 'true'
+    verbose = config['Experiment']['verbose_logging'].lower() == 'true'
+    batch_size = int(config['Experiment'].get('batch_size', '1'))
+    use_pipeline = config['Experiment'].get('pipeline', 'False').lower() == 'true'
+    for question, answer_aliases, predicted_answer in output.resumed_predictions:
+        metrics.add_open_domain_prediction(question, answer_aliases, predicted_answer)
+    dataset = TRACER.traced_iter("dataset_read", output.skip_completed(dataset))
+    progress = tqdm(initial=len(output.resumed_predictions))
+
+    def store_batch(batch):
+        for record in batch:
+            metrics.add_open_domain_prediction(
+                record.question, record.answer_aliases, record.predicted_answer)
+            with TRACER.span("store", records=1):
+                output.store(record)
+        scores = metrics.snapshot()
+        progress.set_description(f"EM: {scores['exact_match'] * 100:.1f} F1: {scores['f1'] * 100:.1f}")
+        progress.update(len(batch))
+
+    if use_pipeline:
+        pipeline = AnnotationPipeline(llm, batch_size=batch_size,
+                                      queue_size=int(config['Experiment'].get('pipeline_queue_size', '2')),
+                                      summarize=summarize, verbose=verbose,
+                                      prepare_on_main_thread='spel' in _realtime_entity_linkers(config))
+        pipeline.run(dataset, store_batch)
+    else:
+        for batch in batched(dataset, batch_size):
+            if batch_size == 1:
+                llm.annotate(batch[0], summarize=summarize, verbose=verbose)
+            else:
+                llm.annotate_batch(batch, summarize=summarize, verbose=verbose)
+            store_batch(batch)
+    progress.close()
+    output.close()
+    retriever = getattr(llm, '_retriever', None)
+    if hasattr(retriever, 'print_summary'):
+        retriever.print_summary()
+    TRACER.close()
+
+def _suffixed_path(path, suffix):
+    root, extension = os.path.splitext(path)
+    return f"{root}.{suffix}{extension}"
+
+def _annotate_shard(config_dict, shard_id):
+    config = configparser.ConfigParser()
+    config.read_dict(config_dict)
+    config['Experiment']['shard_id'] = str(shard_id)
+    if config['Experiment'].get('trace_path', ''):
+        config['Experiment']['trace_path'] = _suffixed_path(config['Experiment']['trace_path'], f"shard{shard_id}")
+    annotate(config)
+
+def _realtime_entity_linkers(config):
+    """
+    the types of the entity linking retrievers (spel, dict) which are run in realtime, including the cascade tiers.
+    """
+    retriever = config['Model.Retriever']
+    realtime = retriever.get('realtime_retrieve', 'False').lower() == 'true'
+    if retriever['type'].lower() != 'cascade':
+        tiers = [[retriever['type']]]
+    else:
+        tiers = [spec.strip().split(':') for spec in retriever.get('cascade_tiers', '').split(',') if spec.strip()]
+    return {tier[0].lower() for tier in tiers if tier[0].lower() in ['spel', 'dict']
+            and (tier[2] == 'realtime' if len(tier) > 2 else realtime)}
+
+def annotate_sharded(config, num_shards):
+    """
+    Runs one annotation process per shard of the dataset (assigned by a stable hash of the questions) and merges the
+     part files of the shards into the StoreResult output file.
+    Experiment.shard_devices optionally lists one CUDA device per shard (e.g. 0,1,2,3); without it the CPU threads
+     are divided evenly between the shards.
+    """
+    linker_types = _realtime_entity_linkers(config)
+    if linker_types:
+        # downloaded and built once here instead of concurrently by every shard process
+        from model.retrievers.prefetch_retrieval_entity_linking import prepare_entity_linker
+        for linker_type in sorted(linker_types):
+            prepare_entity_linker(linker_type, config['Model.Retriever'].get('wikipedia_redirects_path', '') or None)
+    config_dict = {section: dict(config[section]) for section in config.sections()}
+    devices = [d.strip() for d in config['Experiment'].get('shard_devices', '').split(',') if d.strip()]
+    if devices and len(devices) != num_shards:
+        raise ValueError(f"shard_devices should list one device per shard ({num_shards} shards)")
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    original_environ = dict(os.environ)
+    try:
+        for shard_id in range(num_shards):
+            # spawned processes inherit the environment at start, before torch is imported
+            if devices:
+                os.environ['CUDA_VISIBLE_DEVICES'] = devices[shard_id]
+            else:
+                os.environ['OMP_NUM_THREADS'] = str(max(1, (os.cpu_count() or 1) // num_shards))
+            process = context.Process(target=_annotate_shard, args=(config_dict, shard_id))
+            process.start()
+            processes.append(process)
+    finally:
+        os.environ.clear()
+        os.environ.update(original_environ)
+    for process in processes:
+        process.join()
+    failed = [shard_id for shard_id, process in enumerate(processes) if process.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Annotation of shards {failed} failed; rerun with resume=True to continue them")
+    path = StoreResult.output_path(config)
+    StoreResult.merge_shards(path, num_shards, get_dataset(config))
+    print(f"Merged {num_shards} shards into {path}")
+
+def _sweep_values(config, key, default):
+    values = config['Sweep'].get(key, '') if config.has_section('Sweep') else ''
+    return [v.strip() for v in values.split(',') if v.strip()] or [default]
+
+def sweep_settings(config):
+    """
+    Expands the comma separated lists of the Sweep section (retriever_types, prefetched_k_sizes, retriever_top_ks and
+     seeds) into one config per experiment; the experiments which would write the same output file (e.g. closed-book
+     runs with different top-k values) are only listed once.
+    """
+    settings, seen_paths = [], set()
+    seeds = _sweep_values(config, 'seeds', '')
+    for seed in seeds:
+        for retriever_type in _sweep_values(config, 'retriever_types', config['Model.Retriever']['type']):
+            for k_size in _sweep_values(config, 'prefetched_k_sizes', config['Model.Retriever']['prefetched_k_size']):
+                for top_k in _sweep_values(config, 'retriever_top_ks', config['Model.Retriever']['retriever_top_k']):
+                    setting = configparser.ConfigParser()
+                    setting.read_dict({section: dict(config[section]) for section in config.sections()})
+                    setting['Model.Retriever']['type'] = retriever_type
+                    setting['Model.Retriever']['prefetched_k_size'] = k_size
+                    setting['Model.Retriever']['retriever_top_k'] = top_k
+                    if retriever_type.lower() == 'none':
+                        setting['Experiment']['name'] = f"Closed-Book-{retriever_type}"
+                    else:
+                        setting['Experiment']['name'] = f"Open-Book-{retriever_type}"
+                    if len(seeds) > 1:
+                        # the file names do not contain the seed, so each seed writes into its own directory
+                        setting['Experiment']['output_dir'] = os.path.join(
+                            config['Experiment'].get('output_dir', ''), f"seed_{seed}")
+                    path = StoreResult.output_path(setting)
+                    if path in seen_paths:
+                        continue
+                    seen_paths.add(path)
+                    if config['Experiment'].get('trace_path', ''):
+                        # one trace file per experiment, named after its output file
+                        setting['Experiment']['trace_path'] = _suffixed_path(
+                            config['Experiment']['trace_path'], os.path.basename(path)[:-len(".jsonl")])
+                    settings.append((seed, setting))
+    return settings
+
+def run_sweep(config):
+    """
+    Runs all the experiments of the Sweep section in this process, loading the LLM once and only swapping the
+     retrievers between the experiments.
+    """
+    if int(config['Experiment'].get('num_shards', '1')) > 1:
+        raise ValueError("Sweeps run in a single process and do not support num_shards > 1")
+    settings = sweep_settings(config)
+    llm = None
+    for index, (seed, setting) in enumerate(settings):
+        print(f"Sweep experiment {index + 1}/{len(settings)}: {setting['Model.Retriever']['type']} "
+              f"prefetched_k_size={setting['Model.Retriever']['prefetched_k_size']} "
+              f"retriever_top_k={setting['Model.Retriever']['retriever_top_k']} seed={seed or 'none'}")
+        if seed:
+            from transformers import set_seed
+            set_seed(int(seed))
+        output_dir = setting['Experiment'].get('output_dir', '')
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        if llm is None:
+            llm = get_llm(setting)
+        else:
+            llm.set_retriever(setting)
+        annotate(setting, llm)
+
 def main():
     path_ =  pathlib.Path(os.path.abspath(__file__)).parent / '..' / '.checkpoints'
     if not os.path.exists(path_):
@@ -80,20 +299,13 @@ def main():
         config.read_dict(read_configs_from_args(sys.argv[1:]))
     config['Experiment']['checkpoint_path'] = str(path_)
     if config['Experiment']['perform_annotation'].lower() == 'true':
-        dataset = get_dataset(config)
-        output = StoreResult(config)
-        llm = get_llm(config)
-        metrics = EvaluationMetrics(config, config['Dataset']['name'], config['Dataset']['split'])
-        itr = tqdm(dataset)
-        for record in itr:
-            llm.annotate(record, summarize=config['Experiment']['summarize_results'].lower() == 'true', 
-                         verbose=config['Experiment']['verbose_logging'].lower() == 'true')
-            metrics.add_open_domain_prediction(
-                record.question, record.answer_aliases, record.predicted_answer)
-            exact_match = np.mean([x['em'] for x in metrics.open_domain_predictions]) * 100
-            f1 = np.mean([x['f1'] for x in metrics.open_domain_predictions]) * 100
-            itr.set_description(f"EM: {exact_match:.1f} F1: {f1:.1f}")
-            output.store(record)
+        num_shards = int(config['Experiment'].get('num_shards', '1'))
+        if config.has_section('Sweep') and any(v.strip() for v in config['Sweep'].values()):
+            run_sweep(config)
+        elif num_shards > 1:
+            annotate_sharded(config, num_shards)
+        else:
+            annotate(config)
     if config['Evaluate']['perform_evaluation'].lower() == 'true':
         evaluator = QAEvaluate(config)
         evaluator.evaluate()
@@ -0,0 +1,206 @@
+"""
+This is a standalone benchmark of the realtime retrieval-augmented question answering setting (Table 4 of the paper).
+It replays the questions of a dataset split against the realtime retrievers (RealtimeDocumentRetriever) and the HF
+ models and reports the throughput and the tail latencies of three stages:
+ - retrieval: retrieve_passages of the realtime retriever,
+ - generation: generating the answer for a prompt built from the (already retrieved) contexts,
+ - end_to_end: LLMModel.annotate (retrieval, prompt construction and generation).
+
+The requests are either issued by a fixed number of concurrent clients (closed loop, --concurrency) or arrive as a
+ Poisson process with a fixed rate (open loop, --arrival_rate, in which case the latency includes the queueing delay).
+With --concurrency 1 the requests are served on the main thread, which the realtime spel retriever requires: its linker
+ times its subword to word mapping out with signals, which only work in the main thread, so the retrieval and
+ end_to_end stages of spel can only be benchmarked with --concurrency 1.
+The first --warmup requests of each stage are executed but not measured, and the request order and the arrival times
+ are derived from --seed so that the runs are repeatable.
+
+How to use (from the src directory):
+    python model/benchmark_realtime.py --type bm25 --stages retrieval,end_to_end --num_requests 500 --warmup 20 \
+        --concurrency 1 --output bm25_realtime.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import pathlib
+import argparse
+import platform
+import subprocess
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, str(pathlib.Path(os.path.abspath(__file__)).parent.parent))
+
+from data.loader import get_dataset
+from model.retrievers.loader import get_retriever
+from model.models.loader import get_llm
+
+STAGES = ["retrieval", "generation", "end_to_end"]
+
+
+def parse_args():
+    _path = pathlib.Path(os.path.abspath(__file__)).parent.parent / '..' / '.checkpoints'
+    parser = argparse.ArgumentParser(description="Realtime retrieval-augmented QA latency/throughput benchmark")
+    parser.add_argument("--dataset",           type=str, help="Name of the dataset", default='FACTOIDQA')
+    parser.add_argument("--split",             type=str, help="Split of the dataset", default="dev")
+    parser.add_argument("--type",              type=str, help="Type of the realtime retriever (bm25, dpr, ance, dkrr, spel, dict)", default="bm25")
+    parser.add_argument("--model_type",        type=str, help="Type of the LLM (HFLLM or HFLLAMA)", default="HFLLM")
+    parser.add_argument("--hf_model_name",     type=str, help="Name of the HF model", default="meta-llama/Meta-Llama-3-8B")
+    parser.add_argument("--load_in_8bit",      action="store_true", help="Load the HF model in 8 bits")
+    parser.add_argument("--max_tokens",        type=int, help="Maximum number of tokens to generate", default=10)
+    parser.add_argument("--top_k",             type=int, help="Number of passages given to the LLM", default=4)
+    parser.add_argument("--prefetched_k_size", type=int, help="Number of passages retrieved for each question", default=4)
+    parser.add_argument("--max_w",             type=int, help="Number of words of the entity retrieval passages", default=100)
+    parser.add_argument("--el_quantization",   type=str, help="Quantization of the spel entity linker on cpu (none or int8)", default="none")
+    parser.add_argument("--el_cache",          action="store_true", help="Serve the spel annotations from the entity linking cache")
+    parser.add_argument("--stages",            type=str, help=f"Comma separated stages out of {STAGES}", default=",".join(STAGES))
+    parser.add_argument("--num_requests",      type=int, help="Number of measured requests per stage", default=200)
+    parser.add_argument("--warmup",            type=int, help="Number of unmeasured warm-up requests per stage", default=10)
+    parser.add_argument("--concurrency",       type=int, help="Number of concurrent clients (or workers with --arrival_rate)", default=1)
+    parser.add_argument("--arrival_rate",      type=float, help="Open loop arrival rate (requests/second); closed loop if not set", default=None)
+    parser.add_argument("--seed",              type=int, help="Seed of the request order and the arrival times", default=42)
+    parser.add_argument("--shuffle",           action="store_true", help="Replay the questions in a seeded random order")
+    parser.add_argument("--output",            type=str, help="Path of the JSON results file", default="realtime_benchmark.json")
+    args = parser.parse_args()
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'Dataset': {'name': args.dataset, 'split': args.split},
+        'Model': {'name': args.model_type, 'hf_model_name': args.hf_model_name,
+                  'hf_max_tokens_to_generate': str(args.max_tokens), 'hf_llm_load_in_8bit': str(args.load_in_8bit)},
+        'Model.Retriever': {'type': args.type, 'retriever_top_k': str(args.top_k),
+                            'prefetched_k_size': str(args.prefetched_k_size), 'load_in_memory': 'True',
+                            'max_w': str(args.max_w), 'realtime_retrieve': 'True',
+                            'entity_linking_quantization': args.el_quantization, 'entity_linking_cache': str(args.el_cache)},
+        'Experiment': {'name': 'realtime benchmark', 'checkpoint_path': str(_path)},
+    })
+    return args, config
+
+
+def latency_summary(latencies, duration):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "duration_s": duration,
+        "throughput_rps": len(latencies) / duration if duration > 0 else None,
+        "latency_ms": {
+            "mean": float(np.mean(latencies_ms)),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p90": float(np.percentile(latencies_ms, 90)),
+            "p95": float(np.percentile(latencies_ms, 95)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "max": float(np.max(latencies_ms)),
+        },
+    }
+
+
+def replay(requests, function, concurrency, arrival_rate, seed):
+    """
+    calls function on each of the requests and returns their latencies and the wall-clock duration of the replay.
+    In the closed loop mode the latency of a request is its service time, and in the open loop mode it is measured
+     from its scheduled arrival time.
+    With a concurrency of 1 the requests are served on the calling thread.
+    """
+    if arrival_rate is None:
+        def timed(request):
+            start = time.perf_counter()
+            function(request)
+            return time.perf_counter() - start
+        start = time.perf_counter()
+        if concurrency <= 1:
+            latencies = [timed(request) for request in requests]
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                latencies = list(executor.map(timed, requests))
+        return latencies, time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    arrivals = np.cumsum(rng.exponential(1.0 / arrival_rate, size=len(requests)))
+    start = time.perf_counter()
+
+    def timed_arrival(item):
+        arrival, request = item
+        delay = start + arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        function(request)
+        return time.perf_counter() - (start + arrival)
+
+    if concurrency <= 1:
+        latencies = [timed_arrival(item) for item in zip(arrivals, requests)]
+    else:
+        # a free worker takes the next request (in arrival order) and waits for its arrival before serving it
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed_arrival, zip(arrivals, requests)))
+    return latencies, time.perf_counter() - start
+
+
+def environment_description():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    environment = {"python": platform.python_version(), "platform": platform.platform(), "commit": commit,
+                   "cpu_count": os.cpu_count()}
+    try:
+        import torch
+        environment["torch"] = torch.__version__
+        environment["cuda_device"] = torch.cuda.get_device_name(0) if torch.cuda.is_available() else None
+    except ImportError:
+        pass
+    return environment
+
+
+def main():
+    args, config = parse_args()
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError(f"Undefined stage: {stage}! (choose from {STAGES})")
+    if args.type.lower() == "spel" and args.concurrency > 1 and any(s in stages for s in ["retrieval", "end_to_end"]):
+        raise ValueError("The realtime spel linker only runs on the main thread (its timeouts are signal based), "
+                         "benchmark its retrieval and end_to_end stages with --concurrency 1!")
+
+    records = list(get_dataset(config))
+    if args.shuffle:
+        random.Random(args.seed).shuffle(records)
+    total = args.warmup + args.num_requests
+    # the split is replayed from its start (cycling over it if it has fewer questions than requested)
+    records = [records[i % len(records)] for i in range(total)]
+    warmup_records, measured_records = records[:args.warmup], records[args.warmup:]
+
+    needs_llm = any(stage in stages for stage in ["generation", "end_to_end"])
+    llm = get_llm(config) if needs_llm else None
+    retriever = llm._retriever if llm is not None else get_retriever(config)
+
+    results = {"arguments": vars(args), "environment": environment_description(), "stages": {}}
+    for stage in stages:
+        if stage == "retrieval":
+            function = lambda record: retriever.retrieve_passages(record.question, top_k=args.top_k)
+        elif stage == "generation":
+            # the contexts are retrieved ahead of time so that only prompt construction and generation are measured
+            prompts = {}
+            for record in warmup_records + measured_records:
+                if record.question not in prompts:
+                    prompts[record.question] = llm.build_prompt(record, llm.get_context(record))
+            function = lambda record: llm._get_completion(prompts[record.question])
+        else:
+            function = lambda record: llm.annotate(record)
+        print(f"* {stage}: {args.warmup} warm-up and {args.num_requests} measured requests ...")
+        replay(warmup_records, function, args.concurrency, None, args.seed)
+        latencies, duration = replay(measured_records, function, args.concurrency, args.arrival_rate, args.seed)
+        results["stages"][stage] = latency_summary(latencies, duration)
+        summary = results["stages"][stage]
+        print(f"\t{stage}: {summary['throughput_rps']:.2f} req/s, p50 {summary['latency_ms']['p50']:.1f} ms, "
+              f"p95 {summary['latency_ms']['p95']:.1f} ms, p99 {summary['latency_ms']['p99']:.1f} ms")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Stored the benchmark results in {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+A persistent, content-addressed cache of the entity linking annotations of the questions.
+
+The annotations of a linker only depend on the question text and the linker checkpoint, so the runs which link the same
+ questions again (repeated seeds, max_w sweeps, realtime runs and the prefetch script) read them from a local sqlite
+ database instead of running the linker. Each entry is keyed by the blake2b hash of the linker identifier (e.g. the
+ SpEL checkpoint and its finetuned_after_step) and the normalized question, so the annotations of different
+ checkpoints never mix and the database can be shared by all the runs (and processes) on one host.
+
+The questions are normalized with normalize_question (NFC unicode normalization and collapsed whitespace) and the
+ linker must annotate the normalized question, so that the character offsets of the cached annotations are valid for
+ every question which maps to the same entry.
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+
+def normalize_question(question):
+    return " ".join(unicodedata.normalize("NFC", question).split())
+
+
+class AnnotationCache:
+    """
+    How to use:
+        cache = AnnotationCache(".checkpoints/cache/entity_linking.sqlite", "spel-torch_hub-step4")
+        cached = cache.get_many(questions)  # {normalized question: annotations} of the cached questions
+        cache.put_many({normalize_question(q): linker.annotate(normalize_question(q)) for q in missing_questions})
+    """
+    def __init__(self, path, linker_identifier):
+        self.path = path
+        self.linker_identifier = linker_identifier
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS annotations (key BLOB PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.commit()
+        self._lock = threading.Lock()
+
+    def key(self, normalized_question):
+        return hashlib.blake2b(f"{self.linker_identifier}\n{normalized_question}".encode('utf-8'),
+                               digest_size=16).digest()
+
+    def get_many(self, questions):
+        """
+        returns the cached annotations of the (normalized) questions as a {normalized question: annotations} dictionary.
+        """
+        keys = {self.key(q): q for q in {normalize_question(q) for q in questions}}
+        result = {}
+        key_list = list(keys)
+        with self._lock:
+            # sqlite limits the number of the parameters of a statement
+            for i in range(0, len(key_list), 500):
+                chunk = key_list[i:i + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, value FROM annotations WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                for key, value in rows:
+                    result[keys[key]] = json.loads(value)
+        return result
+
+    def put_many(self, annotations):
+        """
+        stores the {normalized question: annotations} dictionary in the cache.
+        """
+        if not annotations:
+            return
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO annotations (key, value) VALUES (?, ?)",
+                                         [(self.key(q), json.dumps(a)) for q, a in annotations.items()])
+            self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,162 @@
+"""
+A dictionary based entity linker: a fast, model free alternative to SpEL for the latency critical entity retrieval.
+
+The mention dictionary maps the surface forms of the entities of the SpEL vocabulary (dl_sa.mentions_itos) to the
+ entities:
+ - the title of each entity (underscores replaced with spaces) and the title without its disambiguation phrase
+    (e.g. "Paris" for Paris_(band)),
+ - the redirects of wikipedia_redirects.json (the redirect -> target mapping used by wikipedia/get_content.py) whose
+    target is in the vocabulary.
+The surface forms are tokenized into case folded words and stored in a hashed token trie (every prefix of a surface
+ form is a node), which the linker scans from left to right taking the longest mention starting at each word.
+ A surface form shared by several entities is resolved to the most popular one: the entity whose title it is (without
+ a disambiguation phrase), then the entity with the most redirects and finally the one with the lowest vocabulary rank.
+Surface forms which only contain stop words are ignored, except for the capitalized multi word titles (e.g. The Who),
+ and so are the mentions which are not capitalized (or numeric) in the question.
+
+The redirects default to the wikipedia_redirects.json bundled with model/retrievers/wikipedia (DEFAULT_REDIRECTS_PATH).
+The dictionary is built once and stored next to the SpEL checkpoints (rebuilt if the redirects file changes), after
+ which linking a question takes a few microseconds.
+
+How to use:
+    linker = DictEntityLinker()
+    annotations = linker.annotate("Grace Kelly by Mika reached the top of the UK Singles Chart in 2007.")
+"""
+import os
+import re
+import json
+import pickle
+import pathlib
+from collections import Counter
+
+from spel.src.spel.model import dl_sa
+from spel.src.spel.configuration import get_checkpoints_dir
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+DISAMBIGUATION_PATTERN = re.compile(r"\s*\([^)]*\)$")
+DICTIONARY_FORMAT_VERSION = 2
+DEFAULT_REDIRECTS_PATH = str(pathlib.Path(os.path.abspath(__file__)).parent.parent / 'retrievers' / 'wikipedia'
+                             / 'wikipedia_redirects.json')
+STOP_WORDS = frozenset("""
+a about after all also an and any are as at be been before but by can could did do does for from had has have he her
+his how i if in into is it its me my no not of on one or our she so than that the their them then there these they
+this to up was we were what when where which who whom whose why will with would you your
+""".split())
+
+
+def tokenize(text):
+    """
+    the case folded word (and punctuation) tokens of the text with their (begin, end) character offsets.
+    """
+    return [(m.group().casefold(), m.start(), m.end()) for m in TOKEN_PATTERN.finditer(text)]
+
+
+class DictEntityLinker:
+    # the annotations are computed faster than they can be read from an AnnotationCache
+    cache_identifier = None
+
+    def __init__(self, redirects_path=DEFAULT_REDIRECTS_PATH, dictionary_path=None):
+        self.redirects_path = redirects_path if redirects_path and os.path.exists(redirects_path) else None
+        if redirects_path and self.redirects_path is None:
+            print(f"{redirects_path} not found, only the titles of the entities are used as their mentions!")
+        self.dictionary_path = dictionary_path or str(get_checkpoints_dir() / 'dict-entity-linker.pkl')
+        self.mentions, self.prefixes = self.load_dictionary()
+
+    def _signature(self):
+        signature = {'version': DICTIONARY_FORMAT_VERSION, 'vocabulary_size': len(dl_sa.mentions_itos)}
+        if self.redirects_path is not None:
+            stat = os.stat(self.redirects_path)
+            signature['redirects'] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        return signature
+
+    def load_dictionary(self):
+        if os.path.exists(self.dictionary_path):
+            with open(self.dictionary_path, 'rb') as f:
+                stored = pickle.load(f)
+            if stored['signature'] == self._signature():
+                return stored['mentions'], stored['prefixes']
+        mentions, prefixes = self.build_dictionary()
+        tmp_path = f"{self.dictionary_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'signature': self._signature(), 'mentions': mentions, 'prefixes': prefixes}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.dictionary_path)
+        return mentions, prefixes
+
+    def build_dictionary(self):
+        """
+        returns the {surface form: entity} dictionary (the surface forms being space joined case folded tokens) and the
+         set of the proper prefixes of the surface forms.
+        """
+        print('Building the mention dictionary of the dictionary entity linker ...')
+        vocabulary = {entity: rank for rank, entity in enumerate(dl_sa.mentions_itos) if rank > 0}
+        surface_forms = []
+        for entity in vocabulary:
+            title = entity.replace('_', ' ')
+            surface_forms.append((title, entity, True))
+            short_title = DISAMBIGUATION_PATTERN.sub('', title)
+            if short_title and short_title != title:
+                surface_forms.append((short_title, entity, False))
+        redirect_counts = Counter()
+        if self.redirects_path is not None:
+            with open(self.redirects_path, 'r') as f:
+                redirects = json.load(f)
+            for redirect, target in redirects.items():
+                target = target.replace(' ', '_')
+                if target in vocabulary:
+                    surface_forms.append((redirect.replace('_', ' '), target, False))
+                    redirect_counts[target] += 1
+        candidates = {}
+        for surface_form, entity, is_title in surface_forms:
+            tokens = [token for token, _, _ in tokenize(surface_form)]
+            if not tokens or (all(token in STOP_WORDS for token in tokens)
+                              and not (is_title and self._is_capitalized_title(surface_form))):
+                continue
+            key = " ".join(tokens)
+            priority = (not is_title, -redirect_counts[entity], vocabulary[entity])
+            if key not in candidates or priority < candidates[key][0]:
+                candidates[key] = (priority, entity)
+        mentions = {key: entity for key, (_, entity) in candidates.items()}
+        prefixes = set()
+        for key in mentions:
+            tokens = key.split(" ")
+            for i in range(1, len(tokens)):
+                prefixes.add(" ".join(tokens[:i]))
+        return mentions, prefixes
+
+    @staticmethod
+    def _is_capitalized_title(title):
+        words = title.split()
+        return len(words) > 1 and all(word[0].isupper() for word in words)
+
+    @staticmethod
+    def _is_name(sentence, tokens):
+        return any(sentence[begin].isupper() or sentence[begin].isdigit() for _, begin, _ in tokens)
+
+    def annotate(self, sentence):
+        tokens = tokenize(sentence)
+        annotations = []
+        i = 0
+        while i < len(tokens):
+            longest, key = None, tokens[i][0]
+            j = i
+            while True:
+                if key in self.mentions:
+                    longest = (j, self.mentions[key])
+                if key not in self.prefixes or j + 1 == len(tokens):
+                    break
+                j += 1
+                key = f"{key} {tokens[j][0]}"
+            # the first word of the questions is lower cased by the dataset loaders, so a (multi word) mention starting
+            #  at the first word is accepted without being capitalized
+            if longest is not None and (self._is_name(sentence, tokens[i:longest[0] + 1])
+                                        or (i == 0 and longest[0] > i)):
+                annotations.append({"annotation": longest[1], "begin_character": tokens[i][1],
+                                    "end_character": tokens[longest[0]][2]})
+                i = longest[0] + 1
+            else:
+                i += 1
+        return annotations
+
+    def annotate_batch(self, sentences):
+        return [self.annotate(sentence) for sentence in sentences]
@@ -3,6 +3,7 @@ This file is a connector which loads SpEL and performs annotation using its pret
 """
 import sys
 import os
+import torch
 sys.path.insert(0, os.path.abspath('../../spel/src'))
 sys.path.insert(0, os.path.abspath('spel/src'))
 from timeout_decorator.timeout_decorator import TimeoutError
@@ -10,24 +11,70 @@ from spel.src.spel.model import SpELAnnotator, dl_sa, tokenizer
 from spel.src.spel.span_annotation import WordAnnotation, PhraseAnnotation
 from spel.src.spel.utils import get_subword_to_word_mapping
 
+QUANTIZATION_MODES = ['none', 'int8']
+
+
 class SpELAnnotate:
-    def __init__(self, finetuned_after_step = 4, device = 'cpu'):
-        self.spel = SpELAnnotator()
-        self.spel.init_model_from_scratch(device=device)
-        if finetuned_after_step == 3:
-            self.spel.shrink_classification_head_to_aida(device)
-        self.spel.load_checkpoint(None, device=device, load_from_torch_hub=True, finetuned_after_step=finetuned_after_step)
+    """
+    The SpEL checkpoint is loaded at the first annotation, so a linker whose annotations are all served from an
+     AnnotationCache never loads the model.
+    With quantization='int8' the linear layers of the loaded model (the RoBERTa encoder and the classification head) are
+     dynamically quantized to int8, which reduces the CPU latency of the linker; see spel_quantization_parity.py for
+     the agreement of its annotations with the full precision model.
+    """
+    def __init__(self, finetuned_after_step = 4, device = 'cpu', quantization = 'none'):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Undefined SpEL quantization mode: {quantization}! (choose from {QUANTIZATION_MODES})")
+        if quantization != 'none' and device != 'cpu':
+            raise ValueError(f"SpEL {quantization} quantization is only supported on cpu!")
+        self.finetuned_after_step = finetuned_after_step
+        self.device = device
+        self.quantization = quantization
+        self._spel = None
+        self.batched_subword_ids_supported = True
 
-    def annotate(self, sentence):
-        inputs = tokenizer(sentence, return_tensors="pt")
-        token_offsets = list(zip(inputs.encodings[0].tokens,inputs.encodings[0].offsets))
-        subword_annotations = self.spel.annotate_subword_ids(
-            inputs.input_ids, k_for_top_k_to_keep=10, token_offsets=token_offsets)
+    @property
+    def cache_identifier(self):
+        """
+        identifies the checkpoint whose annotations are cached (see model/entity_linking/annotation_cache.py).
+        """
+        quantization = f"-{self.quantization}" if self.quantization != 'none' else ''
+        return f"spel-torch_hub-step{self.finetuned_after_step}{quantization}"
+
+    @staticmethod
+    def _quantize_dynamic(spel):
+        # quantize_dynamic only swaps the submodules of the module it is given, so the module attributes of the
+        #  annotator (including the bare nn.Linear classification head) are quantized as the children of a Sequential
+        names = [name for name, module in vars(spel).items() if isinstance(module, torch.nn.Module)]
+        modules = torch.nn.Sequential(*[getattr(spel, name) for name in names]).eval()
+        quantized = torch.quantization.quantize_dynamic(modules, {torch.nn.Linear}, dtype=torch.qint8)
+        for i, name in enumerate(names):
+            setattr(spel, name, quantized[i])
+
+    @property
+    def spel(self):
+        if self._spel is None:
+            spel = SpELAnnotator()
+            spel.init_model_from_scratch(device=self.device)
+            if self.finetuned_after_step == 3:
+                spel.shrink_classification_head_to_aida(self.device)
+            spel.load_checkpoint(None, device=self.device, load_from_torch_hub=True,
+                                 finetuned_after_step=self.finetuned_after_step)
+            if self.quantization == 'int8':
+                self._quantize_dynamic(spel)
+            self._spel = spel
+        return self._spel
+
+    def _phrase_annotations(self, sentence, tokens, token_offsets, subword_annotations):
+        """
+        maps the subword annotations of the sentence (including the annotation of its leading special token) back to
+        its phrase annotations.
+        """
         tokens_offsets = token_offsets[1:-1]
         subword_annotations = subword_annotations[1:]
         try:
             word_annotations = [WordAnnotation(subword_annotations[m[0]:m[1]], tokens_offsets[m[0]:m[1]])
-                                for m in get_subword_to_word_mapping(inputs.tokens(), sentence)]
+                                for m in get_subword_to_word_mapping(tokens, sentence)]
         except TimeoutError:
             return []
         phrase_annotations = []
@@ -45,6 +92,60 @@ class SpELAnnotate:
         } for phrase_annotation in phrase_annotations if phrase_annotation.resolved_annotation != 0]
         return final_result
 
+    @torch.inference_mode()
+    def annotate(self, sentence):
+        inputs = tokenizer(sentence, return_tensors="pt")
+        token_offsets = list(zip(inputs.encodings[0].tokens,inputs.encodings[0].offsets))
+        subword_annotations = self.spel.annotate_subword_ids(
+            inputs.input_ids, k_for_top_k_to_keep=10, token_offsets=token_offsets)
+        return self._phrase_annotations(sentence, inputs.tokens(), token_offsets, subword_annotations)
+
+    def _annotate_subword_ids_batch(self, input_ids, token_offsets):
+        """
+        runs the rows of equal length subword ids through SpEL together and splits the subword annotations per row;
+        returns None if the loaded SpEL version does not annotate all the rows of a batch.
+        """
+        batch_annotations = self.spel.annotate_subword_ids(
+            torch.LongTensor(input_ids), k_for_top_k_to_keep=10,
+            token_offsets=[offset for row_offsets in token_offsets for offset in row_offsets])
+        length = len(input_ids[0])
+        if len(batch_annotations) != length * len(input_ids):
+            return None
+        return [batch_annotations[i * length:(i + 1) * length] for i in range(len(input_ids))]
+
+    @torch.inference_mode()
+    def annotate_batch(self, sentences):
+        """
+        annotates a list of sentences, returning the same annotations as calling annotate on each of them.
+        The sentences are grouped by their subword length and each group runs through the model in a single forward
+         pass; equal lengths (rather than padding) keep the annotations identical to the single sentence annotations
+         as SpEL does not take an attention mask.
+        """
+        if not sentences:
+            return []
+        inputs = tokenizer(list(sentences))
+        groups = dict()
+        for i, ids in enumerate(inputs.input_ids):
+            groups.setdefault(len(ids), []).append(i)
+        results = [None] * len(sentences)
+        for indices in groups.values():
+            token_offsets = [list(zip(inputs.encodings[i].tokens, inputs.encodings[i].offsets)) for i in indices]
+            subword_annotations = None
+            if len(indices) > 1 and self.batched_subword_ids_supported:
+                subword_annotations = self._annotate_subword_ids_batch(
+                    [inputs.input_ids[i] for i in indices], token_offsets)
+                if subword_annotations is None:
+                    print("warning: annotate_subword_ids does not support batches in this SpEL version, "
+                          "annotating one sentence at a time!")
+                    self.batched_subword_ids_supported = False
+            if subword_annotations is None:
+                subword_annotations = [self.spel.annotate_subword_ids(
+                    torch.LongTensor([inputs.input_ids[i]]), k_for_top_k_to_keep=10, token_offsets=offsets)
+                    for i, offsets in zip(indices, token_offsets)]
+            for i, offsets, annotations in zip(indices, token_offsets, subword_annotations):
+                results[i] = self._phrase_annotations(sentences[i], inputs.encodings[i].tokens, offsets, annotations)
+        return results
+
 if __name__ == '__main__':
     m = SpELAnnotate()
     annotations = m.annotate("Grace Kelly by Mika reached the top of the UK Singles Chart in 2007.")
@@ -0,0 +1,142 @@
+"""
+A parity check of the quantized SpEL linker against the full precision (FP32) linker on cpu.
+
+Both linkers annotate the same seeded sample of the questions of a dataset split (one question at a time, as in the
+ realtime entity retrieval) and the script reports:
+ - the latency (mean/p50/p90/p95/p99) and the throughput of each linker along with the speedup of the quantized one,
+ - the agreement of the quantized annotations with the FP32 ones: the fraction of the questions with identical
+    annotations, the fraction with the same set of linked entities (which is all the entity retriever uses) and the
+    micro precision/recall/F1 of the (entity, begin_character, end_character) mentions against the FP32 mentions.
+
+How to use (from the src directory):
+    python model/entity_linking/spel_quantization_parity.py --dataset FACTOIDQA --split train --num_questions 500 \
+        --quantization int8 --output spel_int8_parity.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import pathlib
+import argparse
+import configparser
+
+import torch
+
+sys.path.insert(0, str(pathlib.Path(os.path.abspath(__file__)).parent.parent.parent))
+
+from data.loader import get_dataset
+from model.benchmark_realtime import latency_summary, environment_description
+from model.entity_linking.spel_annotator import SpELAnnotate, QUANTIZATION_MODES
+
+
+def parse_args():
+    _path = pathlib.Path(os.path.abspath(__file__)).parent.parent.parent / '..' / '.checkpoints'
+    parser = argparse.ArgumentParser(description="Parity check of the quantized SpEL linker against the FP32 linker")
+    parser.add_argument("--dataset",       type=str, help="Name of the dataset", default='FACTOIDQA')
+    parser.add_argument("--split",         type=str, help="Split of the dataset", default="train")
+    parser.add_argument("--num_questions", type=int, help="Number of sampled questions", default=500)
+    parser.add_argument("--warmup",        type=int, help="Number of unmeasured warm-up questions per linker", default=10)
+    parser.add_argument("--seed",          type=int, help="Seed of the question sample", default=42)
+    parser.add_argument("--quantization",  type=str, help=f"Quantization mode out of {QUANTIZATION_MODES[1:]}", default="int8")
+    parser.add_argument("--threads",       type=int, help="Number of torch intra-op threads", default=None)
+    parser.add_argument("--output",        type=str, help="Path of the JSON results file", default="spel_quantization_parity.json")
+    args = parser.parse_args()
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'Dataset': {'name': args.dataset, 'split': args.split},
+        'Experiment': {'checkpoint_path': str(_path)},
+    })
+    return args, config
+
+
+def fp32_linear_layers(spel):
+    """
+    the names of the full precision nn.Linear layers among the module attributes of the SpEL annotator.
+    """
+    layers = []
+    for attribute, module in vars(spel).items():
+        if isinstance(module, torch.nn.Module):
+            layers.extend(f"{attribute}.{name}".rstrip('.') for name, m in module.named_modules()
+                          if type(m) is torch.nn.Linear)
+    return layers
+
+
+def annotate_timed(linker, questions, warmup):
+    for question in questions[:warmup]:
+        linker.annotate(question)
+    annotations, latencies = [], []
+    start = time.perf_counter()
+    for question in questions:
+        question_start = time.perf_counter()
+        annotations.append(linker.annotate(question))
+        latencies.append(time.perf_counter() - question_start)
+    return annotations, latency_summary(latencies, time.perf_counter() - start)
+
+
+def agreement(reference_annotations, annotations):
+    """
+    the agreement of the annotations of each question with the reference (FP32) annotations of the question.
+    """
+    identical, same_entities, common, reference_total, total = 0, 0, 0, 0, 0
+    for reference, annotation in zip(reference_annotations, annotations):
+        reference_mentions = {(x['annotation'], x['begin_character'], x['end_character']) for x in reference}
+        mentions = {(x['annotation'], x['begin_character'], x['end_character']) for x in annotation}
+        identical += int(reference == annotation)
+        same_entities += int({x['annotation'] for x in reference} == {x['annotation'] for x in annotation})
+        common += len(reference_mentions & mentions)
+        reference_total += len(reference_mentions)
+        total += len(mentions)
+    precision = common / total if total else 1.0
+    recall = common / reference_total if reference_total else 1.0
+    return {
+        "questions": len(annotations),
+        "identical_annotations": identical / len(annotations),
+        "identical_entity_sets": same_entities / len(annotations),
+        "mention_precision": precision,
+        "mention_recall": recall,
+        "mention_f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+    }
+
+
+def main():
+    args, config = parse_args()
+    if args.quantization not in QUANTIZATION_MODES[1:]:
+        raise ValueError(f"Undefined quantization mode: {args.quantization}! (choose from {QUANTIZATION_MODES[1:]})")
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    questions = list(dict.fromkeys(record.question for record in get_dataset(config)))
+    random.Random(args.seed).shuffle(questions)
+    questions = questions[:args.num_questions]
+
+    print(f"* annotating {len(questions)} questions with the FP32 linker ...")
+    reference_annotations, reference_latency = annotate_timed(SpELAnnotate(), questions, args.warmup)
+    print(f"* annotating {len(questions)} questions with the {args.quantization} linker ...")
+    linker = SpELAnnotate(quantization=args.quantization)
+    remaining = fp32_linear_layers(linker.spel)
+    assert not remaining, f"The {args.quantization} linker keeps full precision linear layers: {remaining}"
+    annotations, latency = annotate_timed(linker, questions, args.warmup)
+
+    results = {
+        "arguments": vars(args),
+        "environment": dict(environment_description(), torch_threads=torch.get_num_threads()),
+        "latency": {"fp32": reference_latency, args.quantization: latency,
+                    "speedup_p50": reference_latency["latency_ms"]["p50"] / latency["latency_ms"]["p50"]},
+        "agreement": agreement(reference_annotations, annotations),
+        "disagreements": [{"question": q, "fp32": r, args.quantization: a}
+                          for q, r, a in zip(questions, reference_annotations, annotations) if r != a][:50],
+    }
+    for name, summary in [("fp32", reference_latency), (args.quantization, latency)]:
+        print(f"\t{name}: {summary['throughput_rps']:.2f} questions/s, p50 {summary['latency_ms']['p50']:.1f} ms, "
+              f"p95 {summary['latency_ms']['p95']:.1f} ms, p99 {summary['latency_ms']['p99']:.1f} ms")
+    a = results["agreement"]
+    print(f"\tp50 speedup: {results['latency']['speedup_p50']:.2f}x, identical annotations: "
+          f"{a['identical_annotations'] * 100:.1f}%, identical entity sets: {a['identical_entity_sets'] * 100:.1f}%, "
+          f"mention F1: {a['mention_f1'] * 100:.1f}%")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Stored the parity check results in {args.output}")
+
+
+if __name__ == '__main__':
+    main()
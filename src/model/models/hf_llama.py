@@ -1,7 +1,9 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig
+from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig, StoppingCriteriaList
 import torch
 
 from model.utils import LLMModel
+from model.models.hf_llm import FirstLineStoppingCriteria, GenerationTimer
+from model.tracing import TRACER
 from model.retrievers.loader import get_retriever
 from data.loader import qa_prompt_with_instructions
 
@@ -24,11 +26,14 @@ class HfLLaMAModel(LLMModel):
         )
         self.tokenizer = AutoTokenizer.from_pretrained(self.hf_model_name)
         self.tokenizer.pad_token = self.tokenizer.eos_token
+        # batched generation pads the prompts on the left so that the generations start at the same position
+        self.tokenizer.padding_side = 'left'
 
         self.retriever_type = config["Model.Retriever"]["type"]
         self.use_retriever = self.retriever_type.lower() != 'none'
         self.top_k = int(config["Model.Retriever"]["retriever_top_k"]) if self.use_retriever else 0
         self._retriever = get_retriever(config)
+        self._retriever_key = self._retriever_key_of(config)
 
         print('*********** Loaded Configurations *****************')
         li8b = '(8-bit quantized)' if load_in_8bit else '(non-quantized)'
@@ -41,17 +46,19 @@ class HfLLaMAModel(LLMModel):
         print('***************************************************')
 
     def _get_completion(self, prompt):
-        input_ids = self.tokenizer.apply_chat_template(
-            prompt,
-            add_generation_prompt=True,
-            return_tensors="pt"
-        ).to(self.model.device)
+        with TRACER.span("tokenization", records=1):
+            input_ids = self.tokenizer.apply_chat_template(
+                prompt,
+                add_generation_prompt=True,
+                return_tensors="pt"
+            ).to(self.model.device)
 
         terminators = [
             self.tokenizer.eos_token_id,
             self.tokenizer.convert_tokens_to_ids("<|eot_id|>")
         ]
 
+        timer = GenerationTimer() if TRACER.enabled else None
         outputs = self.model.generate(
             input_ids,
             max_new_tokens=self.max_tokens_to_generate,
@@ -60,33 +67,95 @@ class HfLLaMAModel(LLMModel):
             temperature=0.000001,
             top_p=1,
             pad_token_id=self.tokenizer.eos_token_id,
+            stopping_criteria=StoppingCriteriaList([timer]) if timer else None,
         )
+        if timer:
+            timer.finish(1)
         response = outputs[0][input_ids.shape[-1]:]
         generation_str = self.tokenizer.decode(response, skip_special_tokens=True)
         return generation_str.split("\n")[0].strip()
 
+    def _get_completion_batch(self, prompts):
+        # the chat template already contains the special tokens
+        with TRACER.span("tokenization", records=len(prompts)):
+            templated_prompts = [self.tokenizer.apply_chat_template(prompt, add_generation_prompt=True, tokenize=False)
+                                 for prompt in prompts]
+            inputs = self.tokenizer(templated_prompts, return_tensors="pt", padding=True,
+                                    add_special_tokens=False).to(self.model.device)
+        prompt_length = inputs.input_ids.shape[-1]
+
+        terminators = [
+            self.tokenizer.eos_token_id,
+            self.tokenizer.convert_tokens_to_ids("<|eot_id|>")
+        ]
+
+        timer = GenerationTimer() if TRACER.enabled else None
+        outputs = self.model.generate(
+            **inputs,
+            max_new_tokens=self.max_tokens_to_generate,
+            eos_token_id=terminators,
+            do_sample=True,
+            temperature=0.000001,
+            top_p=1,
+            pad_token_id=self.tokenizer.eos_token_id,
+            stopping_criteria=StoppingCriteriaList([
+                FirstLineStoppingCriteria(self.tokenizer, prompt_length, terminators)] + ([timer] if timer else [])),
+        )
+        if timer:
+            timer.finish(len(prompts))
+        generations = self.tokenizer.batch_decode(outputs[:, prompt_length:], skip_special_tokens=True)
+        return [generation_str.split("\n")[0].strip() for generation_str in generations]
+
     def get_context(self, record):
         if self.use_retriever:
-            res = self._retriever.retrieve(record.question, top_k=self.top_k)
-            return [(r.content.strip(), r.meta["title"]) for r in res] if res else None
+            res = self._retriever.retrieve_passages(record.question, top_k=self.top_k)
+            return [(r.text.strip(), r.title) for r in res] if res else None
         else:
             return None
 
-    def annotate(self, record, summarize=False, verbose=False):
-        if summarize:
-            print("warning: summarize is not implemented for HfLLMModel!")
-        context_container = self.get_context(record)
+    def get_context_batch(self, records):
+        if self.use_retriever:
+            all_res = self._retriever.retrieve_passages_batch([record.question for record in records], top_k=self.top_k)
+            return [[(r.text.strip(), r.title) for r in res] if res else None for res in all_res]
+        else:
+            return [None for _ in records]
+
+    def build_prompt(self, record, context_container):
         if context_container:
             record.extracted_entity = ";".join([x[1].replace(" ", "_") for x in context_container])
-            prompt = qa_prompt_with_instructions(record.question, max_len=self.max_tokens_to_generate, context=[f"{x[1]}\n\n{x[0]}" for x in context_container])
+            return qa_prompt_with_instructions(record.question, max_len=self.max_tokens_to_generate, context=[f"{x[1]}\n\n{x[0]}" for x in context_container])
         else:
-            extracted_context, record.extracted_entity = None, None
-            prompt = qa_prompt_with_instructions(record.question, max_len=self.max_tokens_to_generate, context=None)
-        generated_answer = self._get_completion(prompt)
+            record.extracted_entity = None
+            return qa_prompt_with_instructions(record.question, max_len=self.max_tokens_to_generate, context=None)
+
+    def set_prediction(self, record, prompt, generated_answer, verbose=False):
         if verbose:
             print(f"---------------------------\n{prompt}\n---------------------------\nGenerated Answer: {generated_answer}\n---------------------------")
         if generated_answer and generated_answer[0] in ["\"", "\'"] and generated_answer[-1] in ["\"", "\'"]:
             generated_answer = generated_answer[1:-1]
         if verbose:
             print(f"Expected Answer: {record.answer}\n---------------------------")
-        record.predicted_answer = generated_answer
\ No newline at end of file
+        record.predicted_answer = generated_answer
+
+    def annotate(self, record, summarize=False, verbose=False):
+        if summarize:
+            print("warning: summarize is not implemented for HfLLMModel!")
+        context_container = self.get_context(record)
+        with TRACER.span("prompt_build", records=1):
+            prompt = self.build_prompt(record, context_container)
+        self.set_prediction(record, prompt, self._get_completion(prompt), verbose)
+
+    def prepare_batch(self, records, summarize=False, verbose=False):
+        if summarize:
+            print("warning: summarize is not implemented for HfLLMModel!")
+        context_containers = self.get_context_batch(records)
+        with TRACER.span("prompt_build", records=len(records)):
+            return [self.build_prompt(record, context_container)
+                    for record, context_container in zip(records, context_containers)]
+
+    def complete_batch(self, records, prepared, summarize=False, verbose=False):
+        for record, prompt, generated_answer in zip(records, prepared, self._get_completion_batch(prepared)):
+            self.set_prediction(record, prompt, generated_answer, verbose)
+
+    def annotate_batch(self, records, summarize=False, verbose=False):
+        self.complete_batch(records, self.prepare_batch(records, summarize, verbose), summarize, verbose)
\ No newline at end of file
@@ -1,13 +1,72 @@
 import torch
 from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer #, LlamaTokenizer
+from transformers import StoppingCriteria, StoppingCriteriaList
 
 from model.utils import LLMModel
+from model.tracing import TRACER
 from model.retrievers.loader import get_retriever
 from data.loader import get_prompt_provider
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
 
+def token_id_list(token_ids):
+    """
+    the token ids as a list, as the eos_token_id of a model config is either a single id, a list of ids or None.
+    """
+    if token_ids is None:
+        return []
+    return [token_ids] if isinstance(token_ids, int) else list(token_ids)
+
+
+class FirstLineStoppingCriteria(StoppingCriteria):
+    """
+    Only the first line of each generation is used as the answer, so each sequence of a batched generation is finished
+     (and padded by generate) as soon as it has generated a new line or one of the stop tokens, and the generation stops
+     once every sequence is finished. Only the newest token of each unfinished sequence is checked at each step.
+    """
+    def __init__(self, tokenizer, prompt_length, stop_token_ids):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop_token_ids = set(token_id_list(stop_token_ids))
+        self.done = None
+
+    def __call__(self, input_ids, scores, **kwargs) -> torch.BoolTensor:
+        if self.done is None or self.done.shape[0] != input_ids.shape[0]:
+            self.done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        if input_ids.shape[-1] > self.prompt_length:
+            rows = (~self.done).nonzero().flatten().tolist()
+            newest = input_ids[rows, -1].tolist()
+            texts = self.tokenizer.batch_decode([[token] for token in newest], skip_special_tokens=True)
+            for row, token, text in zip(rows, newest, texts):
+                if token in self.stop_token_ids or "\n" in text:
+                    self.done[row] = True
+        return self.done.clone()
+
+
+class GenerationTimer(StoppingCriteria):
+    """
+    Never stops the generation; it records when the first generated token is available so that the time spent in
+     generate can be split into the prefill and decode spans of the tracer.
+    """
+    def __init__(self):
+        self.start_ns = TRACER.now()
+        self.first_token_ns = None
+
+    def __call__(self, input_ids, scores, **kwargs) -> torch.BoolTensor:
+        if self.first_token_ns is None:
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            self.first_token_ns = TRACER.now()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    def finish(self, records):
+        end_ns = TRACER.now()
+        first_token_ns = self.first_token_ns if self.first_token_ns is not None else end_ns
+        TRACER.add("prefill", self.start_ns, first_token_ns, records=records)
+        TRACER.add("decode", first_token_ns, end_ns, records=records)
+
+
 class HfLLMModel(LLMModel):
     def __init__(self, config):
         self.config = config
@@ -23,12 +82,18 @@ class HfLLMModel(LLMModel):
         self.model = AutoModelForCausalLM.from_pretrained(self.hf_model_name, cache_dir=self.cache_dir, load_in_8bit=load_in_8bit,
                                                           device_map="auto", low_cpu_mem_usage=True).eval()
         self.tokenizer = AutoTokenizer.from_pretrained(self.hf_model_name)
+        # batched generation pads (and truncates) the prompts on the left so that the generations start at the same position
+        self.tokenizer.padding_side = 'left'
+        self.tokenizer.truncation_side = 'left'
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
 
         self.prompter = get_prompt_provider(config)
         self.retriever_type = config["Model.Retriever"]["type"]
         self.use_retriever = self.retriever_type.lower() != 'none'
         self.top_k = int(config["Model.Retriever"]["retriever_top_k"]) if self.use_retriever else 0
         self._retriever = get_retriever(config)
+        self._retriever_key = self._retriever_key_of(config)
 
         print('*********** Loaded Configurations *****************')
         li8b = '(8-bit quantized)' if load_in_8bit else '(non-quantized)'
@@ -41,38 +106,92 @@ class HfLLMModel(LLMModel):
         print('***************************************************')
 
     def _get_completion(self, prompt):
-        input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to(device)
+        with TRACER.span("tokenization", records=1):
+            input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to(device)
         if input_ids.shape[-1] > self.model_max_length - self.max_tokens_to_generate:
             input_ids = input_ids[..., -(self.model_max_length - self.max_tokens_to_generate):]
+        timer = GenerationTimer() if TRACER.enabled else None
         with torch.no_grad():
             outputs = self.model.generate(
-                input_ids, max_new_tokens=self.max_tokens_to_generate, pad_token_id=self.model.config.eos_token_id)
+                input_ids, max_new_tokens=self.max_tokens_to_generate, pad_token_id=self.model.config.eos_token_id,
+                stopping_criteria=StoppingCriteriaList([timer]) if timer else None)
+        if timer:
+            timer.finish(1)
         generation_str = self.tokenizer.decode(outputs[0].cpu(), skip_special_tokens=True)
         generation_str = generation_str[len(prompt):]
         return generation_str.split("\n")[0].strip()
 
+    def _get_completion_batch(self, prompts):
+        max_prompt_length = self.model_max_length - self.max_tokens_to_generate
+        with TRACER.span("tokenization", records=len(prompts)):
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True, truncation=True,
+                                    max_length=max_prompt_length).to(device)
+        prompt_length = inputs.input_ids.shape[-1]
+        eos_token_ids = token_id_list(self.model.config.eos_token_id)
+        timer = GenerationTimer() if TRACER.enabled else None
+        stopping_criteria = StoppingCriteriaList([
+            FirstLineStoppingCriteria(self.tokenizer, prompt_length, eos_token_ids)] +
+            ([timer] if timer else []))
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs, max_new_tokens=self.max_tokens_to_generate,
+                pad_token_id=eos_token_ids[0] if eos_token_ids else self.tokenizer.pad_token_id,
+                stopping_criteria=stopping_criteria)
+        if timer:
+            timer.finish(len(prompts))
+        generations = self.tokenizer.batch_decode(outputs[:, prompt_length:].cpu(), skip_special_tokens=True)
+        return [generation_str.split("\n")[0].strip() for generation_str in generations]
+
     def get_context(self, record):
         if self.use_retriever:
-            res = self._retriever.retrieve(record.question, top_k=self.top_k)
-            return [(r.content.strip(), r.meta["title"]) for r in res] if res else None
+            res = self._retriever.retrieve_passages(record.question, top_k=self.top_k)
+            return [(r.text.strip(), r.title) for r in res] if res else None
         else:
             return None
 
-    def annotate(self, record, summarize=False, verbose=False):
-        if summarize:
-            print("warning: summarize is not implemented for HfLLMModel!")
-        context_container = self.get_context(record)
+    def get_context_batch(self, records):
+        if self.use_retriever:
+            all_res = self._retriever.retrieve_passages_batch([record.question for record in records], top_k=self.top_k)
+            return [[(r.text.strip(), r.title) for r in res] if res else None for res in all_res]
+        else:
+            return [None for _ in records]
+
+    def build_prompt(self, record, context_container):
         if context_container:
             record.extracted_entity = ";".join([x[1].replace(" ", "_") for x in context_container])
-            prompt = self.prompter(record.question, context=[f"{x[1]}\n\n{x[0]}" for x in context_container])
+            return self.prompter(record.question, context=[f"{x[1]}\n\n{x[0]}" for x in context_container])
         else:
-            extracted_context, record.extracted_entity = None, None
-            prompt = self.prompter(record.question, context=None)
-        generated_answer = self._get_completion(prompt)
+            record.extracted_entity = None
+            return self.prompter(record.question, context=None)
+
+    def set_prediction(self, record, prompt, generated_answer, verbose=False):
         if verbose:
             print(f"---------------------------\n{prompt}\n---------------------------\nGenerated Answer: {generated_answer}\n---------------------------")
         if generated_answer and generated_answer[0] in ["\"", "\'"] and generated_answer[-1] in ["\"", "\'"]:
             generated_answer = generated_answer[1:-1]
         if verbose:
             print(f"Expected Answer: {record.answer}\n---------------------------")
-        record.predicted_answer = generated_answer
\ No newline at end of file
+        record.predicted_answer = generated_answer
+
+    def annotate(self, record, summarize=False, verbose=False):
+        if summarize:
+            print("warning: summarize is not implemented for HfLLMModel!")
+        context_container = self.get_context(record)
+        with TRACER.span("prompt_build", records=1):
+            prompt = self.build_prompt(record, context_container)
+        self.set_prediction(record, prompt, self._get_completion(prompt), verbose)
+
+    def prepare_batch(self, records, summarize=False, verbose=False):
+        if summarize:
+            print("warning: summarize is not implemented for HfLLMModel!")
+        context_containers = self.get_context_batch(records)
+        with TRACER.span("prompt_build", records=len(records)):
+            return [self.build_prompt(record, context_container)
+                    for record, context_container in zip(records, context_containers)]
+
+    def complete_batch(self, records, prepared, summarize=False, verbose=False):
+        for record, prompt, generated_answer in zip(records, prepared, self._get_completion_batch(prepared)):
+            self.set_prediction(record, prompt, generated_answer, verbose)
+
+    def annotate_batch(self, records, summarize=False, verbose=False):
+        self.complete_batch(records, self.prepare_batch(records, summarize, verbose), summarize, verbose)
\ No newline at end of file
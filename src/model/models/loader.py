@@ -1,18 +1,23 @@
+"""
+The LLM backends are registered by name and only imported when selected, so a run does not pay for importing the
+ dependencies (transformers, haystack, openai, ...) of the backends it does not use.
+"""
+import importlib
+
 from model.utils import LLMModel
-from model.models.hf_llm import HfLLMModel
-from model.models.replug.implementation import RePLUG
-from model.models.openai_llm import GPTModel
-from model.models.hf_llama import HfLLaMAModel
+
+LLM_REGISTRY = {
+    "HFLLM": ("model.models.hf_llm", "HfLLMModel"),
+    "RePLUG": ("model.models.replug.implementation", "RePLUG"),
+    "OpenAI": ("model.models.openai_llm", "GPTModel"),
+    "HFLLAMA": ("model.models.hf_llama", "HfLLaMAModel"),
+}
+
+def get_llm_class(model_name):
+    if model_name not in LLM_REGISTRY:
+        raise ValueError(f"Unknown model: {model_name}")
+    module_name, class_name = LLM_REGISTRY[model_name]
+    return getattr(importlib.import_module(module_name), class_name)
 
 def get_llm(config) -> LLMModel:
-    model_name = config['Model']['name']
-    if model_name == "HFLLM":
-        return HfLLMModel(config)
-    elif model_name == "RePLUG":
-        return RePLUG(config)
-    elif model_name == "OpenAI":
-        return GPTModel(config)
-    elif model_name == "HFLLAMA":
-        return HfLLaMAModel(config)
-    else:
-        raise ValueError(f"Unknown model: {model_name}")
\ No newline at end of file
+    return get_llm_class(config['Model']['name'])(config)
\ No newline at end of file
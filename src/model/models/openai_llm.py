@@ -41,6 +41,7 @@ class GPTModel(LLMModel):
         self.use_retriever = self.retriever_type.lower() != 'none'
         self.top_k = int(config["Model.Retriever"]["retriever_top_k"]) if self.use_retriever else 0
         self._retriever = get_retriever(config)
+        self._retriever_key = self._retriever_key_of(config)
         self.max_tokens_to_generate=int(self.config["Model"]["hf_max_tokens_to_generate"])
 
     def _get_completion(self, prompt):
@@ -55,8 +56,8 @@ class GPTModel(LLMModel):
 
     def get_context(self, record):
         if self.use_retriever:
-            res = self._retriever.retrieve(record.question, top_k=self.top_k)
-            return [(r.content.strip(), r.meta["title"]) for r in res] if res else None
+            res = self._retriever.retrieve_passages(record.question, top_k=self.top_k)
+            return [(r.text.strip(), r.title) for r in res] if res else None
         else:
             return None
 
@@ -35,6 +35,7 @@ class RePLUG(LLMModel):
         self.reranker_top_k = reranker_top_k
         load_in_8bit = config["Model"]["hf_llm_load_in_8bit"].lower() == 'true'
         self.retriever = get_retriever(config)
+        self._retriever_key = self._retriever_key_of(config)
         assert self.retriever is not None, "RePLUG does not run in Closed-Book mode!"
         if rerank_retrieved:
             sbert_path = "cross-encoder/ms-marco-MiniLM-L-6-v2"
@@ -53,16 +54,31 @@ class RePLUG(LLMModel):
         self.prompter = PromptNode(model_name_or_path=PrompterModel, default_prompt_template=LFQA)
         self.llm = self.prompter.prompt_model
 
+        if not rerank_retrieved:
+            self.reranker = None
+        self._build_pipeline()
+
+    def _build_pipeline(self):
         self.pipe = Pipeline()
         self.pipe.add_node(component=self.retriever, name='Retriever', inputs=["Query"])
-        if rerank_retrieved:
+        if self.reranker is not None:
             self.pipe.add_node(component=self.reranker, name='Reranker', inputs=["Retriever"])
             self.pipe.add_node(component=self.prompter, name='Prompter', inputs=["Reranker"])
             self.params = {"Retriever": {"top_k": self.retriever_top_k}, "Reranker": {"top_k": self.reranker_top_k}}
         else:
             self.pipe.add_node(component=self.prompter, name='Prompter', inputs=["Retriever"])
             self.params = {"Retriever": {"top_k": self.retriever_top_k}}
-            self.reranker = None
+
+    def set_retriever(self, config):
+        self.config = config
+        self.retriever_top_k = int(config["Model.Retriever"]["retriever_top_k"])
+        retriever_key = self._retriever_key_of(config)
+        if retriever_key != self._retriever_key:
+            self.retriever = None
+            self.retriever = get_retriever(config)
+            self._retriever_key = retriever_key
+        assert self.retriever is not None, "RePLUG does not run in Closed-Book mode!"
+        self._build_pipeline()
 
 
     def annotate(self, record, summarize=False, verbose=False):
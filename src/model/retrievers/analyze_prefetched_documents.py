@@ -95,9 +95,9 @@ def create_plot(dataset_name, split, retriever_type, retriever_prefetched_k_size
     relevance_scores_array = np.zeros((dataset_length, max_k), dtype=int)
     reciprocal_ranks = []
     for item_idx, item in enumerate(tqdm(dataset)):
-        r = retriever.retrieve(query=item.question, top_k=max_k)
+        r = retriever.retrieve_passages(item.question, top_k=max_k)
         if r:
-            relevance_scores = [int(x.meta['has_answer']) for x in r]
+            relevance_scores = [int(x.has_answer) for x in r]
             relevance_scores += [0] * (max_k - len(relevance_scores))
             relevance_scores_array[item_idx] = relevance_scores
             coverage = first_non_zero_index(relevance_scores) + 1
@@ -151,6 +151,13 @@ if __name__ == '__main__':
     dataset_configurations = [('FACTOIDQA', 'train', 2203), ('STRATEGYQA', 'train', 2290), ('STRATEGYQA', 'dev', 2821),
                               ('EntityQuestions', 'dev', 4710), ('EntityQuestions', 'test', 4741)]
     retriever_configurations = [('bm25', 100), ('dpr', 100), ('ance', 100), ('dkrr', 100), ('spel', 50), ('spel', 100), ('spel', 300)]
+    # the dict entity linker documents are only analyzed once they are prefetched locally, e.g. using
+    #  python model/retrievers/prefetch_retrieval_entity_linking.py --type dict --max_w 100 --archive ...
+    local_retriever_configurations = [('dict', 100)]
+    _checkpoint_path_ = pathlib.Path(os.path.abspath(__file__)).parent.parent.parent / '..' / '.checkpoints'
     for _dataset_, _split_, _dataset_length_ in dataset_configurations:
-        for _retriever_type_, _retriever_prefetched_k_size_ in retriever_configurations:
+        for _retriever_type_, _retriever_prefetched_k_size_ in retriever_configurations + local_retriever_configurations:
+            if (_retriever_type_, _retriever_prefetched_k_size_) in local_retriever_configurations and not \
+                    (_checkpoint_path_ / f"{_dataset_}_{_retriever_type_}_{_retriever_prefetched_k_size_}.zip").exists():
+                continue
             create_plot(_dataset_, _split_, _retriever_type_, _retriever_prefetched_k_size_, _dataset_length_)
\ No newline at end of file
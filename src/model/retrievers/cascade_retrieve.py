@@ -0,0 +1,154 @@
+"""
+A cascade of retrievers which serves the passages of its first tier (e.g. the cheap entity retrieval) and only queries
+ the next tiers (e.g. bm25 or ance) for the questions which the previous tiers could not serve.
+
+The tiers are listed in Model.Retriever.cascade_tiers as comma separated `type[:prefetched_k_size[:mode]]` entries,
+ where mode is one of prefetched, in_memory or realtime (the Model.Retriever load_in_memory/realtime_retrieve settings
+ are used if it is not given), e.g.
+    cascade_tiers = spel:100, bm25:100
+    cascade_tiers = dict:100:realtime, bm25:100:in_memory, ance:100:realtime
+The prefetched_k_size of the entity retrievers (spel, oracle) is the number of words of their passages (max_w).
+A tier is queried for a question if the previous tiers returned no passages for it or, with
+ Model.Retriever.cascade_fill_up set, if they returned fewer than the requested top_k passages (in which case the
+ passages of the tier fill up the remaining slots).
+
+The number of questions each tier is queried for, the number of questions it served (returned at least one passage
+ for) and its latency are collected for each tier and printed at the end of the annotation runs.
+"""
+import configparser
+from typing import List, Optional, Union, Dict
+
+import numpy as np
+from haystack import Document
+from haystack.nodes.retriever import BaseRetriever
+from haystack.document_stores import BaseDocumentStore
+from haystack.schema import FilterType
+
+from model.retrievers.loader import get_retriever_class
+from model.retrievers.prefetched_retrieve import RetrievedContext
+from model.tracing import TRACER
+
+CASCADE_MODES = ["prefetched", "in_memory", "realtime"]
+
+
+class CascadeTier:
+    def __init__(self, name, retriever):
+        self.name = name
+        self.retriever = retriever
+        self.queried = 0
+        self.served = 0
+        self.passages = 0
+        self.latencies_ms = []
+
+    def retrieve_passages_batch(self, queries, top_k):
+        start_ns = TRACER.now()
+        all_results = self.retriever.retrieve_passages_batch(queries, top_k=top_k)
+        end_ns = TRACER.now()
+        TRACER.add(f"cascade_{self.name}", start_ns, end_ns, records=len(queries))
+        # the latency of a batch is shared between its queries
+        self.latencies_ms.extend([(end_ns - start_ns) / 1e6 / len(queries)] * len(queries))
+        self.queried += len(queries)
+        self.served += sum(1 for results in all_results if results)
+        self.passages += sum(len(results) for results in all_results)
+        return all_results
+
+
+class CascadeDocumentRetriever(BaseRetriever):
+    def __init__(self, config, topk=None):
+        super().__init__()
+        self.topk = topk if topk is not None else int(config["Model.Retriever"]["retriever_top_k"])
+        self.fill_up = config["Model.Retriever"].get("cascade_fill_up", "False").lower() == 'true'
+        tier_specs = [x.strip() for x in config["Model.Retriever"].get("cascade_tiers", "").split(",") if x.strip()]
+        if not tier_specs:
+            raise ValueError("Model.Retriever.cascade_tiers should list the retrievers of the cascade!")
+        self.tiers = [CascadeTier(spec, self.create_tier_retriever(config, spec)) for spec in tier_specs]
+
+    @staticmethod
+    def create_tier_retriever(config, tier_spec):
+        parts = tier_spec.split(":")
+        if len(parts) > 3 or parts[0].lower() in ['cascade', 'none']:
+            raise ValueError(f"Invalid cascade tier: {tier_spec}!")
+        tier_config = configparser.ConfigParser()
+        tier_config.read_dict({section: dict(config[section]) for section in config.sections()})
+        tier_config["Model.Retriever"]["type"] = parts[0]
+        if len(parts) > 1:
+            tier_config["Model.Retriever"]["prefetched_k_size"] = parts[1]
+            tier_config["Model.Retriever"]["max_w"] = parts[1]
+        if len(parts) > 2:
+            mode = parts[2]
+        elif config["Model.Retriever"]["realtime_retrieve"].lower() == 'true':
+            mode = "realtime"
+        elif config["Model.Retriever"]["load_in_memory"].lower() == 'true':
+            mode = "in_memory"
+        else:
+            mode = "prefetched"
+        if mode not in CASCADE_MODES:
+            raise ValueError(f"Undefined cascade tier mode: {mode}! (choose from {CASCADE_MODES})")
+        if mode == "in_memory":
+            return get_retriever_class(mode)(tier_config, topk=int(tier_config["Model.Retriever"]["prefetched_k_size"]))
+        return get_retriever_class(mode)(tier_config)
+
+    def _needs_next_tier(self, results, top_k):
+        return len(results) < top_k if self.fill_up else not results
+
+    def retrieve_passages(self, query: str, top_k: Optional[int] = None) -> List[RetrievedContext]:
+        return self.retrieve_passages_batch([query], top_k)[0]
+
+    def retrieve_passages_batch(self, queries: List[str], top_k: Optional[int] = None) -> List[List[RetrievedContext]]:
+        top_k = top_k if top_k is not None else self.topk
+        all_results = [[] for _ in queries]
+        pending = list(range(len(queries)))
+        for tier in self.tiers:
+            if not pending:
+                break
+            tier_results = tier.retrieve_passages_batch([queries[i] for i in pending], top_k)
+            for i, results in zip(pending, tier_results):
+                all_results[i].extend(results[:top_k - len(all_results[i])])
+            pending = [i for i in pending if self._needs_next_tier(all_results[i], top_k)]
+        return all_results
+
+    def summary(self):
+        """
+        the number of questions each tier was queried for and served, and its per-question latency (in milliseconds).
+        """
+        result = {}
+        for tier in self.tiers:
+            p50, p95, p99 = np.percentile(tier.latencies_ms, [50, 95, 99]) if tier.latencies_ms else (0.0, 0.0, 0.0)
+            result[tier.name] = {"queried": tier.queried, "served": tier.served, "passages": tier.passages,
+                                 "mean_ms": float(np.mean(tier.latencies_ms)) if tier.latencies_ms else 0.0,
+                                 "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+        return result
+
+    def print_summary(self):
+        total = self.tiers[0].queried
+        if not total:
+            return
+        print('\t'+'='*88)
+        print(f'\t{"cascade tier":<26}{"queried":>10}{"% total":>9}{"served":>10}{"passages":>10}{"p50 ms":>9}'
+              f'{"p95 ms":>9}{"p99 ms":>9}')
+        print('\t'+'='*88)
+        for name, s in self.summary().items():
+            print(f'\t{name:<26}{s["queried"]:>10}{s["queried"] * 100 / total:>8.1f}%{s["served"]:>10}'
+                  f'{s["passages"]:>10}{s["p50_ms"]:>9.2f}{s["p95_ms"]:>9.2f}{s["p99_ms"]:>9.2f}')
+        print('\t'+'='*88)
+
+    def retrieve(self,
+                 query: str,
+                 filters: Optional[FilterType] = None,
+                 top_k: Optional[int] = None,
+                 index: Optional[str] = None,
+                 headers: Optional[Dict[str, str]] = None,
+                 scale_score: Optional[bool] = None,
+                 document_store: Optional[BaseDocumentStore] = None) -> List[Document]:
+        return [x.retriever_document for x in self.retrieve_passages(query, top_k)]
+
+    def retrieve_batch(self,
+                       queries: List[str],
+                       filters: Optional[Union[FilterType, List[Optional[FilterType]]]] = None,
+                       top_k: Optional[int] = None,
+                       index: Optional[str] = None,
+                       headers: Optional[Dict[str, str]] = None,
+                       batch_size: Optional[int] = None,
+                       scale_score: Optional[bool] = None,
+                       document_store: Optional[BaseDocumentStore] = None) -> List[List[Document]]:
+        return [[x.retriever_document for x in passages] for passages in self.retrieve_passages_batch(queries, top_k)]
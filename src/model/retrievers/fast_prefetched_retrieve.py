@@ -1,54 +1,66 @@
 """
-A faster version of PrefetchedDocumentRetriever which caches everything initially and keeps all the retrieved documents
- in memory.
+A faster version of PrefetchedDocumentRetriever which keeps all the prefetched documents in memory.
+The documents are cached once per prefetched artifact in compact memory-mapped columnar arrays (see
+ ColumnarPrefetchedCache) which serve any top_k <= prefetched_k_size and are shared between the runs on one host.
+The passages of the bm25, dpr, ance and dkrr retrievers are deduplicated into a PassageTable shared by all of them.
 """
-import os
-import pickle
 from typing import List, Optional, Union, Dict
-from tqdm import tqdm
 
 from haystack import Document
 from haystack.nodes.retriever import BaseRetriever
 from haystack.document_stores import BaseDocumentStore
 from haystack.schema import FilterType
 
-from data.loader import get_dataset
-from model.retrievers.prefetched_retrieve import PrefetchedDocumentRetriever
+from model.retrievers.prefetched_retrieve import PrefetchedDocumentRetriever, RetrievedContext
+from model.retrievers.prefetched_store import ColumnarPrefetchedCache, PassageTable, DOCID_RETRIEVER_TYPES
+from model.tracing import TRACER
 
 
 
 class FastPrefetchedDocumentRetriever(BaseRetriever):
-    def __init__(self, config, topk):
+    def __init__(self, config, topk=None):
         super().__init__()
         dataset_name = config['Dataset']['name']
         split = config["Dataset"]["split"]
         retriever_type = config["Model.Retriever"]["type"].lower()
-        k_size = int(config["Model.Retriever"]["prefetched_k_size"])
-        self.topk = topk
+        self.k_size = int(config["Model.Retriever"]["prefetched_k_size"])
+        self.topk = topk if topk is not None else self.k_size
         self.config = config
-        cache_directory = config["Experiment"]["checkpoint_path"] + "/cache"
-        if not os.path.exists(cache_directory):
-            os.makedirs(cache_directory)
-        self.preprocessed_file_name = f"{cache_directory}/{dataset_name}_{split}_{retriever_type}_{k_size}_{topk}.cache.pkl"
-        if not os.path.exists(self.preprocessed_file_name):
-            print('Creating FastPrefetchedDocumentRetriever cache ...')
-            self.prefetched_documents = {}
-            dataset = get_dataset(self.config)
-            retriever = PrefetchedDocumentRetriever(self.config)
-            for record in tqdm(dataset):
-                self.prefetched_documents[record.question] = retriever.retrieve(record.question, top_k=self.topk)
-            with open(self.preprocessed_file_name, 'wb') as file:
-                pickle.dump(self.prefetched_documents, file)
-        else:
-            with open(self.preprocessed_file_name, 'rb') as file:
-                self.prefetched_documents = pickle.load(file)
+        cache_directory = f"{config['Experiment']['checkpoint_path']}/cache"
+        # the passages of the retrievers over the DPR wikipedia split are stored once for all such retrievers
+        passage_table = PassageTable(f"{cache_directory}/{dataset_name}.passages") \
+            if retriever_type in DOCID_RETRIEVER_TYPES else None
+        # only the (downloaded) archive of the prefetched retriever is used, from which the cache is built directly
+        archive = PrefetchedDocumentRetriever(config, load_store=False)
+        self.prefetched_documents = ColumnarPrefetchedCache(
+            f"{cache_directory}/{dataset_name}_{split}_{retriever_type}_{self.k_size}.columns", archive.zip_path,
+            archive.current_file, passage_table)
 
-    def fetch_documents(self, query):
-        if query in self.prefetched_documents:
-            return self.prefetched_documents[query]
-        else:
+    def fetch_documents(self, query, top_k=None) -> List[RetrievedContext]:
+        with TRACER.span("retrieval_search", records=1):
+            question_id = self.prefetched_documents.find(query)
+        if question_id is None:
             raise ValueError(f"Query \"{query}\" not found in pre-fetched documents!")
-        
+        with TRACER.span("document_fetch", records=1):
+            return [RetrievedContext.convert(x) for x in self.prefetched_documents.read_contexts(question_id, top_k)]
+
+    def retrieve_passages(self, query: str, top_k: Optional[int] = None) -> List[RetrievedContext]:
+        top_k = top_k if top_k is not None else self.topk
+        assert top_k <= self.k_size, f"Top-k should be less than or equal to {self.k_size}"
+        return self.fetch_documents(query, top_k)
+
+    def retrieve_passages_batch(self, queries: List[str], top_k: Optional[int] = None) -> List[List[RetrievedContext]]:
+        top_k = top_k if top_k is not None else self.topk
+        assert top_k <= self.k_size, f"Top-k should be less than or equal to {self.k_size}"
+        with TRACER.span("retrieval_search", records=len(queries)):
+            question_ids = [self.prefetched_documents.find(query) for query in queries]
+        for query, question_id in zip(queries, question_ids):
+            if question_id is None:
+                raise ValueError(f"Query \"{query}\" not found in pre-fetched documents!")
+        with TRACER.span("document_fetch", records=len(queries)):
+            return [[RetrievedContext.convert(x) for x in contexts]
+                    for contexts in self.prefetched_documents.read_contexts_batch(question_ids, top_k)]
+
     def retrieve(self,
                  query: str,
                  filters: Optional[FilterType] = None,
@@ -57,9 +69,8 @@ class FastPrefetchedDocumentRetriever(BaseRetriever):
                  headers: Optional[Dict[str, str]] = None,
                  scale_score: Optional[bool] = None,
                  document_store: Optional[BaseDocumentStore] = None) -> List[Document]:
-        assert top_k is not None and top_k <= self.topk, f"Top-k should be less than or equal to {self.topk}"
-        return self.fetch_documents(query)[:top_k]
-        
+        return [x.retriever_document for x in self.retrieve_passages(query, top_k)]
+
 
     def retrieve_batch(self,
                        queries: List[str],
@@ -70,5 +81,4 @@ class FastPrefetchedDocumentRetriever(BaseRetriever):
                        batch_size: Optional[int] = None,
                        scale_score: Optional[bool] = None,
                        document_store: Optional[BaseDocumentStore] = None) -> List[List[Document]]:
-        assert top_k is not None and top_k <= self.topk, f"Top-k should be less than or equal to {self.topk}"
-        return [self.fetch_documents(query)[:top_k] for query in queries]
\ No newline at end of file
+        return [[x.retriever_document for x in passages] for passages in self.retrieve_passages_batch(queries, top_k)]
@@ -1,22 +1,38 @@
-from typing import Union
-from haystack.nodes.retriever import BaseRetriever
+"""
+The retriever implementations are registered by name and only imported when selected, so the closed-book runs never
+ import haystack or pyserini.
+"""
+import importlib
+from typing import Union, TYPE_CHECKING
 
-from model.retrievers.prefetched_retrieve import PrefetchedDocumentRetriever
-from model.retrievers.fast_prefetched_retrieve import FastPrefetchedDocumentRetriever
-from model.retrievers.realtime_retrieve import RealtimeDocumentRetriever
+if TYPE_CHECKING:
+    from haystack.nodes.retriever import BaseRetriever
 
+RETRIEVER_REGISTRY = {
+    "realtime": ("model.retrievers.realtime_retrieve", "RealtimeDocumentRetriever"),
+    "in_memory": ("model.retrievers.fast_prefetched_retrieve", "FastPrefetchedDocumentRetriever"),
+    "prefetched": ("model.retrievers.prefetched_retrieve", "PrefetchedDocumentRetriever"),
+    "cascade": ("model.retrievers.cascade_retrieve", "CascadeDocumentRetriever"),
+}
 
-def get_retriever(config) -> Union[BaseRetriever, None]:
+def get_retriever_class(name):
+    module_name, class_name = RETRIEVER_REGISTRY[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+def get_retriever(config) -> Union['BaseRetriever', None]:
     retriever_type = config["Model.Retriever"]["type"]
     use_retriever = retriever_type.lower() != 'none'
     retriever_top_k = int(config["Model.Retriever"]["retriever_top_k"])
     retriever_load_in_memory = config['Model.Retriever']['load_in_memory'].lower() == 'true'
     retriever_realtime_retrieve = config['Model.Retriever']['realtime_retrieve'].lower() == 'true'
-    if retriever_realtime_retrieve and use_retriever:
-        return RealtimeDocumentRetriever(config)
+    if retriever_type.lower() == 'cascade':
+        # the tiers of the cascade are created with their own prefetched/in_memory/realtime settings
+        return get_retriever_class("cascade")(config, topk=retriever_top_k)
+    elif retriever_realtime_retrieve and use_retriever:
+        return get_retriever_class("realtime")(config)
     elif retriever_load_in_memory and use_retriever:
-        return FastPrefetchedDocumentRetriever(config, topk=retriever_top_k)
+        return get_retriever_class("in_memory")(config, topk=retriever_top_k)
     elif use_retriever:
-        return PrefetchedDocumentRetriever(config)
+        return get_retriever_class("prefetched")(config)
     else:
         return None
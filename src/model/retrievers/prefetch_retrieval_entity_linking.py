@@ -9,15 +9,16 @@ import string
 import argparse
 import configparser
 import pathlib
-import jsonlines
-from tqdm import tqdm
 import sys
 
 sys.path.insert(0, os.path.abspath('../../model/entity_linking/'))
 
-from data.loader import get_dataset
 from model.entity_linking.spel_annotator import SpELAnnotate
 from model.entity_linking.spel_vocab_to_wikipedia import SpELVocab2Wikipedia
+from model.entity_linking.dict_annotator import DictEntityLinker, DEFAULT_REDIRECTS_PATH
+from model.entity_linking.annotation_cache import AnnotationCache, normalize_question
+from model.tracing import TRACER
+from model.retrievers.prefetch_shards import prefetch_sharded, archive_prefetched_file
 
 def normalize_answer(s):
     def remove_articles(text):
@@ -53,53 +54,130 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Script to prefetch retrieval documents")
     parser.add_argument("--dataset",     type=str, help="Name of the dataset", default='FACTOIDQA')
     parser.add_argument("--split",       type=str, help="Split of the dataset", default="train")
-    parser.add_argument("--type",        type=str, help="Type of the retriever", default="spel")
+    parser.add_argument("--type",        type=str, help="Type of the retriever (spel or dict)", default="spel")
+    parser.add_argument("--redirects",   type=str, help="Path to the wikipedia_redirects.json mentions of the dict retriever (defaults to the bundled file)", default="")
     parser.add_argument("--max_w",       type=int, help="Number of first words of the retrieved article for each question", default=100)
     parser.add_argument("--output_file", type=str, help="Output file name", default="el_output.jsonl")
+    parser.add_argument("--batch_size",  type=int, help="Number of questions linked together", default=64)
+    parser.add_argument("--no_cache",    action="store_true", help="Do not read or store the annotations in the entity linking cache")
+    parser.add_argument("--quantization", type=str, help="Quantization of the entity linker on cpu (none or int8)", default="none")
+    parser.add_argument("--num_workers", type=int, help="Number of worker processes (each loading its own entity linker)", default=1)
+    parser.add_argument("--num_shards",  type=int, help="Number of resumable shards of the split (defaults to num_workers)", default=None)
+    parser.add_argument("--archive",     action="store_true", help="Also store the output in the prefetched archive of PrefetchedDocumentRetriever")
     args = parser.parse_args()
     config = configparser.ConfigParser()
     config.read_dict({
         'Dataset': {'name' : args.dataset, 'split': args.split},
-        'Model.Retriever': {'type': args.type, 'max_w': args.max_w},
-        'Experiment': {'checkpoint_path': _path, 'output_file': args.output_file}
+        'Model.Retriever': {'type': args.type, 'max_w': args.max_w, 'entity_linking_cache': str(not args.no_cache),
+                            'entity_linking_quantization': args.quantization, 'wikipedia_redirects_path': args.redirects},
+        'Experiment': {'checkpoint_path': _path, 'output_file': args.output_file, 'batch_size': args.batch_size}
     })
-    return config
+    return config, args
 
-def instantiate_entity_linker(retriever_type):
+def instantiate_entity_linker(retriever_type, quantization='none', redirects_path=None):
     if retriever_type == "spel":
-        linker = SpELAnnotate()
+        linker = SpELAnnotate(quantization=quantization)
+        lookup_index = SpELVocab2Wikipedia()
+    elif retriever_type == "dict":
+        linker = DictEntityLinker(redirects_path or DEFAULT_REDIRECTS_PATH)
         lookup_index = SpELVocab2Wikipedia()
     else:
         raise ValueError(f"Invalid entity linking retriever type: {retriever_type}")
     return linker, lookup_index
 
+def prepare_entity_linker(retriever_type, redirects_path=None):
+    """
+    downloads the SpEL checkpoint and the wikipedia articles and builds the article store (and the mention dictionary
+     of the dict linker) once, so that the processes started afterwards (e.g. the prefetch workers) only load them.
+    """
+    SpELVocab2Wikipedia.load_articles()
+    if retriever_type == "spel":
+        SpELAnnotate().spel
+    elif retriever_type == "dict":
+        DictEntityLinker(redirects_path or DEFAULT_REDIRECTS_PATH)
+    else:
+        raise ValueError(f"Invalid entity linking retriever type: {retriever_type}")
+
 class FetchEntityRetrievalDocuments:
     def __init__(self, config):
         super().__init__()
         self.retriever_type = config["Model.Retriever"]["type"].lower()
         self.retriever_max_w = int(config["Model.Retriever"]["max_w"])
         self.checkpoint_path = config["Experiment"]["checkpoint_path"]
-        self.linker, self.lookup_index = instantiate_entity_linker(self.retriever_type)
+        self.linker, self.lookup_index = instantiate_entity_linker(
+            self.retriever_type, config["Model.Retriever"].get("entity_linking_quantization", "none").lower(),
+            config["Model.Retriever"].get("wikipedia_redirects_path", "") or None)
+        self.annotation_cache = None
+        if config["Model.Retriever"].get("entity_linking_cache", "True").lower() == 'true' \
+                and self.linker.cache_identifier is not None:
+            self.annotation_cache = AnnotationCache(f"{self.checkpoint_path}/cache/entity_linking.sqlite",
+                                                    self.linker.cache_identifier)
 
-    def fetch_documents(self, question, answer_aliases):
+    def annotate_batch(self, questions):
+        """
+        returns the entity linking annotations of the (normalized) questions, only running the linker for the questions
+        which are not in the annotation cache. The questions are normalized with or without the cache, so that the cache
+        never changes the annotations or their character offsets.
+        """
+        if self.annotation_cache is None:
+            return self.linker.annotate_batch([normalize_question(q) for q in questions])
+        annotations = self.annotation_cache.get_many(questions)
+        missing = list(dict.fromkeys(normalize_question(q) for q in questions
+                                     if normalize_question(q) not in annotations))
+        if missing:
+            linked = dict(zip(missing, self.linker.annotate_batch(missing)))
+            self.annotation_cache.put_many(linked)
+            annotations.update(linked)
+        return [annotations[normalize_question(q)] for q in questions]
+
+    def _fetch_annotated_documents(self, annotations, answer_aliases):
         results = []
         considered_entities = set()
-        for line_no, x in enumerate(self.linker.annotate(question)):
+        for line_no, x in enumerate(annotations):
             if x['annotation'] in considered_entities:
                 continue
             entity = x['annotation']
             considered_entities.add(entity)
-            wikipedia_txt = self.lookup_index.get_wikipedia_article(x['annotation'])
+            wikipedia_txt = self.lookup_index.get_wikipedia_article(x['annotation'], self.retriever_max_w)
             if wikipedia_txt:
                 title = entity.replace("_", " ")
-                passage = title + "\n" + " ".join(wikipedia_txt.split()[:self.retriever_max_w])
+                passage = title + "\n" + wikipedia_txt
                 results.append({'id': line_no,'rank': line_no + 1, 'title': title, 'text': passage, 'score': str(1.0), 'has_answer': text_has_answer(answer_aliases, passage)})
         return results
 
+    def fetch_documents(self, question, answer_aliases):
+        with TRACER.span("entity_linking", records=1):
+            annotations = self.linker.annotate(normalize_question(question)) if self.annotation_cache is None \
+                else self.annotate_batch([question])[0]
+        with TRACER.span("document_fetch", records=1):
+            return self._fetch_annotated_documents(annotations, answer_aliases)
+
+    def fetch_batch_documents(self, batch_question_answers):
+        """
+        links the entities of a batch of (question, answer_aliases) pairs with a single call to the batched linker.
+        """
+        batch_questions = [x[0] for x in batch_question_answers]
+        with TRACER.span("entity_linking", records=len(batch_questions)):
+            all_annotations = self.annotate_batch(batch_questions)
+        with TRACER.span("document_fetch", records=len(batch_questions)):
+            all_results = [self._fetch_annotated_documents(annotations, x[1])
+                           for annotations, x in zip(all_annotations, batch_question_answers)]
+        return all_results, batch_questions
+
+def prepare_fetcher(config):
+    prepare_entity_linker(config["Model.Retriever"]["type"].lower(),
+                          config["Model.Retriever"].get("wikipedia_redirects_path", "") or None)
+
+def create_fetcher(config):
+    return FetchEntityRetrievalDocuments(config)
+
+def fetch_batch(fetcher, records):
+    all_results, batch_questions = fetcher.fetch_batch_documents([(e.question, e.answer_aliases) for e in records])
+    return [{"question": question, "context": context} for question, context in zip(batch_questions, all_results)]
+
 if __name__ == '__main__':
-    cfg = parse_args()
-    dataset = get_dataset(cfg)
-    retriever = FetchEntityRetrievalDocuments(cfg)
-    with jsonlines.open(cfg['Experiment']['output_file'], mode='w') as writer:
-        for e in tqdm(dataset):
-            writer.write({"question": e.question, "context": retriever.fetch_documents(e.question, e.answer_aliases)})
\ No newline at end of file
+    cfg, args = parse_args()
+    prefetch_sharded(cfg, create_fetcher, fetch_batch, num_workers=args.num_workers, num_shards=args.num_shards,
+                     batch_size=args.batch_size, prepare=prepare_fetcher)
+    if args.archive:
+        archive_prefetched_file(args.output_file, cfg, args.type, args.max_w)
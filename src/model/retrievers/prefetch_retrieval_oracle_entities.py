@@ -10,11 +10,10 @@ import argparse
 import configparser
 import pathlib
 import jsonlines
-import json
-from tqdm import tqdm
 
 
-from data.loader import get_dataset
+from model.retrievers.wikipedia.article_store import ArticleStore
+from model.retrievers.prefetch_shards import prefetch_sharded, archive_prefetched_file
 
 def normalize_answer(s):
     def remove_articles(text):
@@ -53,6 +52,9 @@ def parse_args():
     parser.add_argument("--wikipedia_articles", type=str, help="Path to the created output of model.retrievers.wikipedia.get_content.py")
     parser.add_argument("--max_w",              type=int, help="Number of first words of the retrieved article for each question", default=100)
     parser.add_argument("--output_file",        type=str, help="Output file name", default="oracle_output.jsonl")
+    parser.add_argument("--num_workers",        type=int, help="Number of worker processes", default=1)
+    parser.add_argument("--num_shards",         type=int, help="Number of resumable shards of the split (defaults to num_workers)", default=None)
+    parser.add_argument("--archive",            action="store_true", help="Also store the output in the prefetched archive of PrefetchedDocumentRetriever")
     args = parser.parse_args()
     config = configparser.ConfigParser()
     config.read_dict({
@@ -60,44 +62,24 @@ def parse_args():
         'Model.Retriever': {'wikipedia_articles_path': args.wikipedia_articles, 'max_w': args.max_w},
         'Experiment': {'checkpoint_path': _path, 'output_file': args.output_file}
     })
-    return config
+    return config, args
 
 
 class FetchOracleEntityRetrievalDocuments:
     def __init__(self, config):
         super().__init__()
         self.wikipedia_articles_path = config["Model.Retriever"]["wikipedia_articles_path"]
-        self.wikiepdia_article_lines = self.scan_jsonl_file(self.wikipedia_articles_path)
+        self.article_store = ArticleStore.open(self.wikipedia_articles_path, f"{self.wikipedia_articles_path}.store",
+                                               key_transform=lambda k: k.replace(' ', '_'))
+        self.wikiepdia_article_lines = self.article_store.index
         self.retriever_max_w = int(config["Model.Retriever"]["max_w"])
         self.checkpoint_path = config["Experiment"]["checkpoint_path"]
         self.missing_entities = set()
 
-    @staticmethod
-    def scan_jsonl_file(file_name):
-        newline_positions_in_file = []
-        tmp_dict = dict()
-        wikipedia_lines = dict()
-        starting_byte = 0
-        with open(file_name, "rb") as fh:
-            for line_id, line in tqdm(enumerate(fh)):
-                obj = json.loads(line)
-                k, _ = next(iter(obj.items()))
-                tmp_dict[line_id] = k.replace(' ', '_')
-                newline_positions_in_file.append(starting_byte)
-                starting_byte = fh.tell()
-
-        for obj_ind, obj in enumerate(newline_positions_in_file):
-            wikipedia_lines[tmp_dict[obj_ind]] = obj
-        return wikipedia_lines
-
-    def get_wikipedia_article(self, entity):
-        if entity not in self.wikiepdia_article_lines:
-            return ''
-        with open(self.wikipedia_articles_path, 'r') as bigFile:
-            bigFile.seek(self.wikiepdia_article_lines[entity])
-            json_line = bigFile.readline().strip()
-            _, wikipedia_txt = next(iter(json.loads(json_line).items()))
-        return " ".join(wikipedia_txt.split())
+    def get_wikipedia_article(self, entity, max_w=None):
+        if max_w is None:
+            return self.article_store.get(entity)
+        return self.article_store.get_first_words(entity, max_w)
 
     def fetch_documents(self, record):
         results = []
@@ -112,24 +94,34 @@ class FetchOracleEntityRetrievalDocuments:
             if entity not in self.wikiepdia_article_lines and entity not in self.missing_entities:
                 print(f'{entity} not in the fetched articles, You may need to refine your wikipedia_articles file to contain this entity.')
                 self.missing_entities.add(entity)
-            wikipedia_txt = self.get_wikipedia_article(entity)
+            wikipedia_txt = self.get_wikipedia_article(entity, self.retriever_max_w)
             if wikipedia_txt:
                 title = entity.replace("_", " ")
-                passage = title + "\n" + " ".join(wikipedia_txt.split()[:self.retriever_max_w])
+                passage = title + "\n" + wikipedia_txt
                 results.append({'id': line_no,'rank': line_no + 1, 'title': title, 'text': passage, 'score': str(1.0), 'has_answer': text_has_answer(answer_aliases, passage)})
         return results
 
+def prepare_fetcher(config):
+    path = config["Model.Retriever"]["wikipedia_articles_path"]
+    ArticleStore.open(path, f"{path}.store", key_transform=lambda k: k.replace(' ', '_'))
+
+def create_fetcher(config):
+    return FetchOracleEntityRetrievalDocuments(config)
+
+def fetch_batch(fetcher, records):
+    return [{"question": e.question, "context": fetcher.fetch_documents(e)} for e in records]
+
 if __name__ == '__main__':
-    cfg = parse_args()
-    dataset = get_dataset(cfg)
-    retriever = FetchOracleEntityRetrievalDocuments(cfg)
+    cfg, args = parse_args()
+    prefetch_sharded(cfg, create_fetcher, fetch_batch, num_workers=args.num_workers, num_shards=args.num_shards,
+                     prepare=prepare_fetcher)
     successful_fetch = 0.0
     all_fetch = 0.0
-    with jsonlines.open(cfg['Experiment']['output_file'], mode='w') as writer:
-        for e in tqdm(dataset):
+    with jsonlines.open(cfg['Experiment']['output_file'], mode='r') as reader:
+        for line in reader:
             all_fetch += 1.0
-            ctxt = retriever.fetch_documents(e)
-            if ctxt:
+            if line['context']:
                 successful_fetch += 1.0
-            writer.write({"question": e.question, "context": ctxt})
-    print(f"Successful fetch percentage: {successful_fetch * 100/all_fetch:.2f}% ({int(successful_fetch)}/{int(all_fetch)})")
\ No newline at end of file
+    print(f"Successful fetch percentage: {successful_fetch * 100/all_fetch:.2f}% ({int(successful_fetch)}/{int(all_fetch)})")
+    if args.archive:
+        archive_prefetched_file(args.output_file, cfg, 'oracle', args.max_w)
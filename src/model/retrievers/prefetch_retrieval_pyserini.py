@@ -24,6 +24,7 @@ import jsonlines
 from tqdm import tqdm
 
 from data.loader import get_dataset
+from model.tracing import TRACER
 
 try:
     from pyserini.search.lucene import LuceneSearcher
@@ -113,10 +114,9 @@ class PrefetchRetrievalDocuments:
         else:
             raise ValueError(f'Retriever: {self.retriever_type} not available!')
 
-    def fetch_documents(self, question, answer_aliases):
-        hits = self.searcher.search(question, k=self.k)
+    def _convert_hits(self, hits, answer_aliases):
         results = []
-        for i in range(0, self.k):
+        for i in range(0, min(self.k, len(hits))):
             element = hits[i]
             passage = json.loads(self._get_raw(element))['contents']
             title = passage.split("\n")[0]
@@ -124,25 +124,30 @@ class PrefetchRetrievalDocuments:
              'score': str(element.score), 'has_answer': text_has_answer(answer_aliases, passage)})
         return results
 
+    def fetch_documents(self, question, answer_aliases):
+        with TRACER.span("retrieval_search", records=1):
+            hits = self.searcher.search(question, k=self.k)
+        with TRACER.span("document_fetch", records=1):
+            return self._convert_hits(hits, answer_aliases)
+
     def fetch_batch_documents(self, batch_question_answers, threads):
-        assert self.encoder is not None
+        """
+        searches a batch of (question, answer_aliases) pairs with a single call to the pyserini batch search.
+        """
         batch_questions = [x[0] for x in batch_question_answers]
         batch_answers = [x[1] for x in batch_question_answers]
-
-        input_ids = self.encoder.tokenizer(batch_questions, return_tensors='pt', padding=True, truncation=True)
-        input_ids.to(DEVICE)
-        encoded_queries = self.encoder.model(input_ids["input_ids"]).pooler_output.detach().cpu().numpy()
-        all_hits = self.searcher.batch_search(encoded_queries, q_ids=[str(i) for i, _ in enumerate(batch_questions)], k=self.k, threads=threads)
-        all_results = []
-        for hits, answer_aliases in zip(all_hits.values(), batch_answers):
-            _results_ = []
-            for i in range(0, self.k):
-                element = hits[i]
-                passage = json.loads(self._get_raw(element))['contents']
-                title = passage.split("\n")[0]
-                _results_.append({'id': element.docid,'rank': i + 1, 'title': title, 'text': passage,
-                                'score': str(element.score), 'has_answer': text_has_answer(answer_aliases, passage)})
-            all_results.append(_results_)
+        q_ids = [str(i) for i, _ in enumerate(batch_questions)]
+        with TRACER.span("retrieval_search", records=len(batch_questions)):
+            if self.encoder is None:
+                all_hits = self.searcher.batch_search(batch_questions, q_ids, k=self.k, threads=threads)
+            else:
+                input_ids = self.encoder.tokenizer(batch_questions, return_tensors='pt', padding=True, truncation=True)
+                input_ids.to(DEVICE)
+                encoded_queries = self.encoder.model(input_ids["input_ids"]).pooler_output.detach().cpu().numpy()
+                all_hits = self.searcher.batch_search(encoded_queries, q_ids, k=self.k, threads=threads)
+        with TRACER.span("document_fetch", records=len(batch_questions)):
+            all_results = [self._convert_hits(all_hits[q_id], answer_aliases)
+                           for q_id, answer_aliases in zip(q_ids, batch_answers)]
         return all_results, batch_questions
 
 if __name__ == '__main__':
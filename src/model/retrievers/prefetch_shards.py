@@ -0,0 +1,148 @@
+"""
+Multi-process, resumable prefetching of the retrieval documents of a dataset split (used by the entity linking and the
+ oracle entity prefetch scripts).
+
+The questions of the split are assigned to num_shards shards by a stable hash (see data.loaders.utils.question_shard)
+ and a pool of num_workers processes prefetches the shards. The resources shared by the workers (e.g. the downloaded
+ checkpoints and the article store) are prepared once in the parent process before the pool is started, then each
+ worker loads its fetcher (e.g. one SpEL model) once and gets an equal share of the CPU threads. A worker writes the contexts of a shard into its own part file and marks
+ it as complete with a `.done` file, so a rerun after a crash only prefetches the shards which were not completed.
+Once all the shards are complete, the part files are merged (in the order of the dataset) into the output jsonl file,
+ which can also be stored in the prefetched archive read by PrefetchedDocumentRetriever (see archive_prefetched_file).
+
+How to use (the functions must be defined at the module level so that the spawned workers can load them):
+    def create_fetcher(config):
+        return FetchEntityRetrievalDocuments(config)
+    def fetch_batch(fetcher, records):
+        all_results, questions = fetcher.fetch_batch_documents([(e.question, e.answer_aliases) for e in records])
+        return [{"question": q, "context": c} for q, c in zip(questions, all_results)]
+    prefetch_sharded(config, create_fetcher, fetch_batch, num_workers=8, prepare=prepare_fetcher)
+"""
+import os
+import glob
+import shutil
+import configparser
+import multiprocessing
+from zipfile import ZipFile, ZIP_DEFLATED
+
+import jsonlines
+from tqdm import tqdm
+
+from data.loader import get_dataset
+from data.loaders.utils import ShardedDataset, DatasetSplit
+from data.store import StoreResult
+from model.retrievers.prefetched_store import prefetched_member_name
+from pipeline import batched
+
+_worker = {}
+
+
+def _done_path(part_path):
+    return f"{part_path}.done"
+
+
+def _init_worker(config_dict, create_fetcher, fetch_batch, num_threads):
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+    config = configparser.ConfigParser()
+    config.read_dict(config_dict)
+    _worker['config'] = config
+    _worker['fetch_batch'] = fetch_batch
+    try:
+        _worker['fetcher'] = create_fetcher(config)
+    except Exception as e:
+        # an exception raised in a pool initializer is not reported and the pool keeps replacing the failed worker,
+        #  so it is kept and raised by the shards of the worker instead
+        _worker['error'] = f"{type(e).__name__}: {e}"
+
+
+def _prefetch_shard(shard_id, num_shards, part_path, batch_size):
+    if 'error' in _worker:
+        raise RuntimeError(f"Creating the fetcher of the worker failed: {_worker['error']}")
+    config = _worker['config']
+    dataset = ShardedDataset(get_dataset(config), num_shards, shard_id)
+    with jsonlines.open(f"{part_path}.tmp", mode='w') as writer:
+        for records in batched(dataset, batch_size):
+            writer.write_all(_worker['fetch_batch'](_worker['fetcher'], records))
+    os.replace(f"{part_path}.tmp", part_path)
+    open(_done_path(part_path), 'w').close()
+    return shard_id
+
+
+def prefetch_sharded(config, create_fetcher, fetch_batch, num_workers=1, num_shards=None, batch_size=64,
+                     prepare=None):
+    """
+    prefetches the documents of the split of config['Dataset'] into config['Experiment']['output_file'], skipping the
+     shards which have been completed by a previous run.
+    create_fetcher(config) creates the fetcher of a worker and fetch_batch(fetcher, records) returns the
+     {"question": ..., "context": [...]} lines of a batch of records.
+    prepare(config), if given, is called once before the workers are started (e.g. to download the checkpoints and
+     build the stores which all the workers would otherwise build at the same time).
+    """
+    output_file = config['Experiment']['output_file']
+    num_shards = num_shards or num_workers
+    part_paths = [StoreResult.shard_path(output_file, shard_id, num_shards) for shard_id in range(num_shards)]
+    pending = [shard_id for shard_id in range(num_shards)
+               if not (os.path.exists(_done_path(part_paths[shard_id])) and os.path.exists(part_paths[shard_id]))]
+    if len(pending) < num_shards:
+        print(f"Skipping {num_shards - len(pending)}/{num_shards} shards completed by a previous run")
+    if pending:
+        if prepare is not None:
+            prepare(config)
+        config_dict = {section: dict(config[section]) for section in config.sections()}
+        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+        if num_workers == 1:
+            _init_worker(config_dict, create_fetcher, fetch_batch, num_threads)
+            for shard_id in tqdm(pending, desc="shards"):
+                _prefetch_shard(shard_id, num_shards, part_paths[shard_id], batch_size)
+        else:
+            original_environ = dict(os.environ)
+            # the spawned workers inherit the environment at start, before torch is imported
+            os.environ['OMP_NUM_THREADS'] = str(num_threads)
+            os.environ['MKL_NUM_THREADS'] = str(num_threads)
+            try:
+                context = multiprocessing.get_context('spawn')
+                with context.Pool(min(num_workers, len(pending)), initializer=_init_worker,
+                                  initargs=(config_dict, create_fetcher, fetch_batch, num_threads)) as pool:
+                    results = [pool.apply_async(_prefetch_shard, (shard_id, num_shards, part_paths[shard_id],
+                                                                  batch_size)) for shard_id in pending]
+                    for result in tqdm(results, desc="shards"):
+                        result.get()
+            finally:
+                os.environ.clear()
+                os.environ.update(original_environ)
+    StoreResult.merge_shards(output_file, num_shards, get_dataset(config))
+    for part_path in part_paths:
+        if os.path.exists(_done_path(part_path)):
+            os.remove(_done_path(part_path))
+    print(f"Merged {num_shards} shards into {output_file}")
+
+
+def archive_prefetched_file(jsonl_path, config, retriever_type, k_size):
+    """
+    stores the prefetched jsonl file as the split member of {checkpoint_path}/{dataset}_{retriever_type}_{k_size}.zip
+     (the archive layout of PrefetchedDocumentRetriever) and removes the stores and caches built from a previous
+     version of that member.
+    """
+    dataset_name = config['Dataset']['name']
+    checkpoint_path = str(config['Experiment']['checkpoint_path'])
+    member = prefetched_member_name(dataset_name, DatasetSplit.from_str(config['Dataset']['split']))
+    archive_name = f"{dataset_name}_{retriever_type}_{k_size}"
+    zip_path = f"{checkpoint_path}/{archive_name}.zip"
+    with ZipFile(f"{zip_path}.tmp", 'w', ZIP_DEFLATED) as out:
+        if os.path.exists(zip_path):
+            with ZipFile(zip_path, 'r') as existing:
+                for item in existing.infolist():
+                    if item.filename != member:
+                        out.writestr(item, existing.read(item.filename))
+        out.write(jsonl_path, member)
+    os.replace(f"{zip_path}.tmp", zip_path)
+    for path in glob.glob(f"{checkpoint_path}/prefetched/{archive_name}_{member[:-len('.jsonl')]}.*"):
+        os.remove(path)
+    split_cache = f"{checkpoint_path}/cache/{dataset_name}_{config['Dataset']['split']}_{retriever_type}_{k_size}.columns"
+    if os.path.exists(split_cache):
+        shutil.rmtree(split_cache)
+    print(f"Stored {jsonl_path} as {member} in {zip_path}")
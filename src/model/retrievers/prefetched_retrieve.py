@@ -7,15 +7,16 @@ our supported QA datasets. We use the pre-built indexes in pyserini which are bu
 We have run our dumping script in src/prefetch_retrieval_documents.sh and have stored the created dump URLS in PREPROCESSED_URLS.
 You can create the dumps for newly implemented datasets using the same script.
 """
+import os
 from typing import List, Optional, Union, Dict
 import json
-from zipfile import ZipFile
-from tqdm import tqdm
 from haystack import Document
 from haystack.nodes.retriever import BaseRetriever
 from haystack.document_stores import BaseDocumentStore
 from haystack.schema import FilterType
 from data.loaders.utils import download_public_file, DatasetSplit
+from model.retrievers.prefetched_store import PrefetchedStore, prefetched_member_name
+from model.tracing import TRACER
 
 # in the following oracle and spel retriever types refer to documents that are collected as the first 100 words of the
 #  wikipedia articles of the salient entities in questions which have either been gold annotated (oracle) or identified
@@ -65,24 +66,24 @@ PREPROCESSED_URLS = {
 }
 
 class RetrievedContext:
-    def __init__(self):
-        self.id = None
-        self.rank = None
-        self.title = None
-        self.text = None
-        self.score = None
-        self.has_answer = None
+    """
+    A lightweight view of a retrieved passage which the LLM implementations consume directly. The haystack Document of
+     the passage is only created (through retriever_document) when a haystack pipeline (i.e. RePLUG) requires one.
+    """
+    __slots__ = ('id', 'rank', 'title', 'text', 'score', 'has_answer')
+
+    def __init__(self, id=None, rank=None, title=None, text=None, score=None, has_answer=None):
+        self.id = id
+        self.rank = rank
+        self.title = title
+        self.text = text
+        self.score = score
+        self.has_answer = has_answer
 
     @staticmethod
     def convert(record):
-        self = RetrievedContext()
-        self.id = record['id']
-        self.rank = record['rank']
-        self.title = record['title']
-        self.text = record['text']
-        self.score = float(record['score'])
-        self.has_answer = record['has_answer']
-        return self
+        return RetrievedContext(record['id'], record['rank'], record['title'], record['text'], float(record['score']),
+                                record['has_answer'])
 
     def __str__(self):
         return json.dumps({'id': self.id, 'rank': self.rank, 'title': self.title, 'text': self.text,
@@ -94,68 +95,51 @@ class RetrievedContext:
                                                              'score': str(self.score), 'has_answer': self.has_answer})
 
 class PrefetchedDocumentRetriever(BaseRetriever):
-    def __init__(self, config):
+    def __init__(self, config, load_store=True):
+        """
+        with load_store=False only the archive of the retriever is made available (e.g. for ColumnarPrefetchedCache).
+        """
         super().__init__()
         dataset_name = config['Dataset']['name']
         retriever_type = config["Model.Retriever"]["type"].lower()
         k_size = int(config["Model.Retriever"]["prefetched_k_size"])
         self.preprocessed_file_name = f"{dataset_name}_{retriever_type}_{k_size}.zip"
+        self.checkpoint_path = config["Experiment"]["checkpoint_path"]
         if self.preprocessed_file_name in PREPROCESSED_URLS:
             _url = PREPROCESSED_URLS[self.preprocessed_file_name]
-        else:
+            self.dataset_url = f"https://1sfu-my.sharepoint.com/:u:/g/personal/sshavara_sfu_ca/{_url}&download=1"
+            download_public_file(self.dataset_url, f"{self.checkpoint_path}/{self.preprocessed_file_name}")
+        elif not os.path.exists(f"{self.checkpoint_path}/{self.preprocessed_file_name}"):
+            # the archives created locally by the prefetch scripts (with --archive) are used as they are
             raise ValueError(
                 f"Invalid prefetched retriever configuration setting ({retriever_type}/{k_size}) for {dataset_name}!")
-        self.dataset_url = f"https://1sfu-my.sharepoint.com/:u:/g/personal/sshavara_sfu_ca/{_url}&download=1"
-        self.checkpoint_path = config["Experiment"]["checkpoint_path"]
-        download_public_file(self.dataset_url, f"{self.checkpoint_path}/{self.preprocessed_file_name}")
         self.split = DatasetSplit.from_str(config["Dataset"]["split"])
         self.dataset_name = dataset_name
-        self.lookup_lines = self.scan_data_file()
+        self.zip_path = f"{self.checkpoint_path}/{self.preprocessed_file_name}"
+        self.store = PrefetchedStore(self.zip_path, self.current_file, f"{self.checkpoint_path}/prefetched") \
+            if load_store else None
 
     @property
     def current_file(self):
-        if self.dataset_name == "FACTOIDQA":
-            return "data.jsonl"
-        if self.split == DatasetSplit.TRAIN:
-            return "train.jsonl"
-        elif self.split == DatasetSplit.DEV:
-            return "dev.jsonl"
-        elif self.split == DatasetSplit.TEST:
-            return "test.jsonl"
-        else:
-            raise ValueError(f"Invalid split {self.split}")
-
-    def scan_data_file(self):
-        """
-        loads the questions along with their line number in the downloaded file into a dictionary.
-        """
-        print(f'Scanning/Indexing prefetched retrieval documents in {self.preprocessed_file_name} jsonl file '
-              f'[{self.split.value} split] ...')
-        newline_positions_in_file = []
-        tmp_dict = dict()
-        _lines = dict()
-        starting_byte = 0
-        with ZipFile(f"{self.checkpoint_path}/{self.preprocessed_file_name}", 'r') as zip_ref:
-            with zip_ref.open(self.current_file) as fh:
-                for line_id, line in tqdm(enumerate(fh)):
-                    obj = json.loads(line)
-                    k = obj['question']
-                    tmp_dict[line_id] = k
-                    newline_positions_in_file.append(starting_byte)
-                    starting_byte = fh.tell()
-
-        for obj_ind, obj in enumerate(newline_positions_in_file):
-            _lines[tmp_dict[obj_ind]] = obj
-        return _lines
-
-    def fetch_documents(self, question: str):
-        if question not in self.lookup_lines:
+        return prefetched_member_name(self.dataset_name, self.split)
+
+    def fetch_documents(self, question: str, top_k: Optional[int] = None) -> List[RetrievedContext]:
+        with TRACER.span("retrieval_search", records=1):
+            question_id = self.store.find(question)
+        if question_id is None:
             return []
-        with ZipFile(f"{self.checkpoint_path}/{self.preprocessed_file_name}", 'r') as zip_ref:
-            with zip_ref.open(self.current_file) as bigFile:
-                bigFile.seek(self.lookup_lines[question])
-                json_line = bigFile.readline().strip()
-                return [RetrievedContext.convert(x).retriever_document for x in json.loads(json_line)['context']]
+        with TRACER.span("document_fetch", records=1):
+            return [RetrievedContext.convert(x) for x in self.store.read_contexts(question_id, top_k)]
+
+    def retrieve_passages(self, query: str, top_k: Optional[int] = None) -> List[RetrievedContext]:
+        return self.fetch_documents(query, top_k)
+
+    def retrieve_passages_batch(self, queries: List[str], top_k: Optional[int] = None) -> List[List[RetrievedContext]]:
+        with TRACER.span("retrieval_search", records=len(queries)):
+            question_ids = [self.store.find(query) for query in queries]
+        with TRACER.span("document_fetch", records=len(queries)):
+            return [[RetrievedContext.convert(x) for x in contexts]
+                    for contexts in self.store.read_contexts_batch(question_ids, top_k)]
 
     def retrieve(self,
                  query: str,
@@ -165,7 +149,7 @@ class PrefetchedDocumentRetriever(BaseRetriever):
                  headers: Optional[Dict[str, str]] = None,
                  scale_score: Optional[bool] = None,
                  document_store: Optional[BaseDocumentStore] = None) -> List[Document]:
-        return self.fetch_documents(query)[:top_k]
+        return [x.retriever_document for x in self.fetch_documents(query, top_k)]
 
     def retrieve_batch(self,
                        queries: List[str],
@@ -176,4 +160,4 @@ class PrefetchedDocumentRetriever(BaseRetriever):
                        batch_size: Optional[int] = None,
                        scale_score: Optional[bool] = None,
                        document_store: Optional[BaseDocumentStore] = None) -> List[List[Document]]:
-        return [self.fetch_documents(query)[:top_k] for query in queries]
\ No newline at end of file
+        return [[x.retriever_document for x in passages] for passages in self.retrieve_passages_batch(queries, top_k)]
\ No newline at end of file
@@ -0,0 +1,537 @@
+"""
+Random-access storage for the prefetched retrieval documents.
+
+The prefetched retrieval files are distributed as zip archives (see PREPROCESSED_URLS in prefetched_retrieve.py). Seeking
+ inside a deflate stream decompresses everything from the start of the member up to the requested offset, which makes
+ per-question lookups in the archive quadratic in the file size. PrefetchedStore converts the requested member of an
+ archive once into an uncompressed store (under {checkpoint_path}/prefetched) and then serves every lookup as a slice of
+ a memory map of that store.
+
+The store keeps one retrieved context per line, in rank order and grouped by question, along with the byte offsets of
+ the context lines and the first context line of each question. Reading the top-k contexts of a question therefore only
+ decodes the first k contexts instead of the whole prefetched list.
+
+The store records the path, member, size and modification time of its source archive in a meta file and is rebuilt
+ if the archive changes (e.g. when archive_prefetched_file stores a new version of the member).
+
+The questions of the store are indexed in a sidecar file which holds the sorted 64-bit hashes of the questions along
+ with their question numbers. The sidecar is validated against the source archive and the size and modification time
+ of the questions file, and is loaded as a read-only memory map so that the worker processes on one host share its pages.
+
+ColumnarPrefetchedCache is the compact in-memory counterpart of the store used by FastPrefetchedDocumentRetriever. It
+ keeps all the prefetched contexts of an artifact in columnar arrays (ids, ranks, scores, has_answer bits and offsets
+ into one text buffer) which are memory-mapped from {checkpoint_path}/cache, so it serves any top_k <= prefetched_k_size
+ and the runs on one host share its pages. It is built directly from the archive, without an intermediate store.
+
+The bm25, dpr, ance and dkrr retrievers all return passages of the same DPR wikipedia split, so popular passages repeat
+ thousands of times across questions and retrievers. For these retrievers, the columnar cache only keeps the
+ (docid, score, has_answer) triplets of each result list, and the passages are stored once in a PassageTable shared
+ by all the retriever types (and splits) of a dataset.
+"""
+import os
+import re
+import mmap
+import json
+import time
+import shutil
+import hashlib
+from zipfile import ZipFile
+import numpy as np
+from tqdm import tqdm
+
+from data.loaders.utils import DatasetSplit
+
+QUESTION_INDEX_DTYPE = np.dtype([('hash', '<u8'), ('line', '<i8')])
+# the retriever types whose prefetched context ids are passage identifiers of the DPR wikipedia split (psgs_w100.tsv)
+DOCID_RETRIEVER_TYPES = ["bm25", "dpr", "ance", "dkrr"]
+COLUMNAR_CACHE_FORMAT_VERSION = 2
+
+
+def question_hash(question):
+    return int.from_bytes(hashlib.blake2b(question.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def prefetched_member_name(dataset_name, split):
+    """
+    the name of the jsonl file of the split inside the prefetched archives of the dataset (e.g. FACTOIDQA_bm25_100.zip).
+    """
+    if dataset_name == "FACTOIDQA":
+        return "data.jsonl"
+    if split == DatasetSplit.TRAIN:
+        return "train.jsonl"
+    elif split == DatasetSplit.DEV:
+        return "dev.jsonl"
+    elif split == DatasetSplit.TEST:
+        return "test.jsonl"
+    else:
+        raise ValueError(f"Invalid split {split}")
+
+
+def _source_signature(zip_path, member):
+    """
+    identifies the version of the archive member from which a store or a cache is built.
+    """
+    stat = os.stat(zip_path)
+    return {'zip_path': os.path.abspath(zip_path), 'member': member, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _prefetched_lines(zip_path, member):
+    """
+    iterates over the {"question": ..., "context": [...]} lines of the member of the zip file.
+    """
+    with ZipFile(zip_path, 'r') as zip_ref:
+        with zip_ref.open(member) as fh:
+            for line in tqdm(fh):
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _write_json_atomically(obj, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _move_in_place(tmp_directory, target_directory):
+    """
+    moves a completely written directory in place at once, so partially written directories are never loaded.
+    """
+    try:
+        os.replace(tmp_directory, target_directory)
+    except OSError:
+        if not os.path.exists(target_directory):
+            raise
+        # another process has written the same directory in the meantime
+        shutil.rmtree(tmp_directory)
+
+
+class QuestionIndex:
+    """
+    A sorted array of (question hash, question number) pairs loaded as a read-only memory map.
+    """
+    def __init__(self, index_path):
+        self.index = np.load(index_path, mmap_mode='r')
+        self.hashes = self.index['hash']
+
+    @staticmethod
+    def save(question_lines, index_path):
+        """
+        stores the question number of each question hash in question_lines, sorted by hash.
+        """
+        index = np.array(sorted(question_lines.items()), dtype=QUESTION_INDEX_DTYPE) if question_lines \
+            else np.zeros(0, dtype=QUESTION_INDEX_DTYPE)
+        tmp_index_path = f"{index_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_index_path, index)
+        os.replace(tmp_index_path, index_path)
+
+    def find(self, question):
+        """
+        returns the question number of the question or None if the question is not indexed.
+        """
+        h = question_hash(question)
+        pos = int(np.searchsorted(self.hashes, np.uint64(h)))
+        if pos < len(self.hashes) and int(self.hashes[pos]) == h:
+            return int(self.index['line'][pos])
+        return None
+
+
+class PrefetchedContexts:
+    """
+    The lookup functionality shared by PrefetchedStore and ColumnarPrefetchedCache. The implementations provide
+     self.question_index, self.rows (the contexts of question number j are the contexts [rows[j], rows[j + 1])) and
+     read_contexts(question_id, top_k).
+    """
+    def find(self, question):
+        """
+        returns the question number of the question or None if the question is not stored.
+        """
+        return self.question_index.find(question)
+
+    def __contains__(self, question):
+        return self.find(question) is not None
+
+    def __len__(self):
+        return len(self.rows) - 1
+
+    def context_count(self, question_id):
+        return int(self.rows[question_id + 1] - self.rows[question_id])
+
+    def read_contexts_batch(self, question_ids, top_k=None):
+        """
+        reads the contexts of a batch of question numbers (None entries result in empty lists) in a single pass over
+        the stored contexts sorted by their position, and returns them in the original order of question_ids.
+        """
+        results = [[] for _ in question_ids]
+        requested = [(int(self.rows[q]), i, q) for i, q in enumerate(question_ids) if q is not None]
+        for _, i, q in sorted(requested):
+            results[i] = self.read_contexts(q, top_k)
+        return results
+
+
+class PrefetchedStore(PrefetchedContexts):
+    """
+    How to use:
+    store = PrefetchedStore(f"{checkpoint_path}/FACTOIDQA_bm25_100.zip", "data.jsonl", f"{checkpoint_path}/prefetched")
+    contexts = store.read_contexts(store.find(question), top_k=4)
+    """
+    def __init__(self, zip_path, member, store_directory):
+        if not os.path.exists(store_directory):
+            os.makedirs(store_directory, exist_ok=True)
+        base_name = f"{os.path.basename(zip_path)[:-len('.zip')]}_{member[:-len('.jsonl')]}"
+        self.data_path = f"{store_directory}/{base_name}.contexts.jsonl"
+        self.offsets_path = f"{store_directory}/{base_name}.offsets.npy"
+        self.rows_path = f"{store_directory}/{base_name}.rows.npy"
+        self.questions_path = f"{store_directory}/{base_name}.questions.jsonl"
+        self.source_meta_path = f"{store_directory}/{base_name}.source.json"
+        self.source_signature = _source_signature(zip_path, member)
+        if not self.is_valid():
+            self.build(zip_path, member)
+        # context line i of the data file is stored in [offsets[i], offsets[i + 1])
+        self.offsets = np.load(self.offsets_path, mmap_mode='r')
+        # the contexts of question number j are the context lines [rows[j], rows[j + 1])
+        self.rows = np.load(self.rows_path, mmap_mode='r')
+        self._fh = open(self.data_path, 'rb')
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] > 0 else b''
+        self.question_index_path = f"{store_directory}/{base_name}.questions.npy"
+        self.question_index_meta_path = f"{store_directory}/{base_name}.questions.json"
+        if not self.question_index_is_valid():
+            self.build_question_index()
+        self.question_index = QuestionIndex(self.question_index_path)
+
+    def is_valid(self):
+        """
+        checks that the store is complete and has been built from the current version of the source archive.
+        """
+        return os.path.exists(self.rows_path) and _read_json(self.source_meta_path) == self.source_signature
+
+    def build(self, zip_path, member):
+        """
+        decompresses the member of the zip file once, splitting the prefetched contexts of each question into separate
+        lines, and stores the starting byte of each context line and the first context line of each question.
+        """
+        print(f'Converting {member} of {os.path.basename(zip_path)} into a random-access prefetched store ...')
+        offsets = [0]
+        rows = [0]
+        pid = os.getpid()
+        with open(f"{self.data_path}.{pid}.tmp", 'wb') as out, \
+                open(f"{self.questions_path}.{pid}.tmp", 'w', encoding='utf-8') as questions_out:
+            for obj in _prefetched_lines(zip_path, member):
+                questions_out.write(f"{json.dumps(obj['question'])}\n")
+                for context in obj['context']:
+                    context_line = f"{json.dumps(context)}\n".encode('utf-8')
+                    out.write(context_line)
+                    offsets.append(offsets[-1] + len(context_line))
+                rows.append(len(offsets) - 1)
+        np.save(f"{self.offsets_path}.{pid}.tmp.npy", np.array(offsets, dtype=np.int64))
+        np.save(f"{self.rows_path}.{pid}.tmp.npy", np.array(rows, dtype=np.int64))
+        # the source meta file is written last, so a store is only considered complete once all of its files exist.
+        os.replace(f"{self.data_path}.{pid}.tmp", self.data_path)
+        os.replace(f"{self.questions_path}.{pid}.tmp", self.questions_path)
+        os.replace(f"{self.offsets_path}.{pid}.tmp.npy", self.offsets_path)
+        os.replace(f"{self.rows_path}.{pid}.tmp.npy", self.rows_path)
+        _write_json_atomically(self.source_signature, self.source_meta_path)
+
+    def _question_index_signature(self):
+        stat = os.stat(self.questions_path)
+        return {'source': self.source_signature, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def question_index_is_valid(self):
+        if not os.path.exists(self.question_index_path):
+            return False
+        return _read_json(self.question_index_meta_path) == self._question_index_signature()
+
+    def build_question_index(self):
+        """
+        hashes each question of the store and stores the (hash, question number) pairs sorted by hash.
+        In case of repeated questions, the last occurrence of the question is kept.
+        """
+        print(f'Indexing the questions of {os.path.basename(self.questions_path)} ...')
+        _lines = dict()
+        with open(self.questions_path, 'r', encoding='utf-8') as f:
+            for line_id, line in enumerate(tqdm(f)):
+                _lines[question_hash(json.loads(line))] = line_id
+        QuestionIndex.save(_lines, self.question_index_path)
+        _write_json_atomically(self._question_index_signature(), self.question_index_meta_path)
+
+    def read_contexts(self, question_id, top_k=None):
+        """
+        decodes the first top_k (all if None) prefetched contexts of the question number in their rank order.
+        """
+        start, end = int(self.rows[question_id]), int(self.rows[question_id + 1])
+        if top_k is not None:
+            end = min(end, start + top_k)
+        return [json.loads(self._mm[int(self.offsets[i]):int(self.offsets[i + 1])]) for i in range(start, end)]
+
+    def __del__(self):
+        if isinstance(getattr(self, '_mm', None), mmap.mmap):
+            self._mm.close()
+        if hasattr(self, '_fh'):
+            self._fh.close()
+
+
+class PassageTable:
+    """
+    An append-only table of (title, text) passages keyed by their DPR wikipedia docid, stored as memory-mapped segments
+     under table_directory. Each segment holds the sorted docids of its passages, the [title_start, text_start, end)
+     bounds of each passage in its text buffer and the text buffer itself. Adding the prefetched documents of a new
+     retriever only writes a new segment for the passages which are not already in the table.
+    How to use:
+    table = PassageTable(f"{checkpoint_path}/cache/FACTOIDQA.passages")
+    title, text = table.get(docid)
+    """
+    def __init__(self, table_directory):
+        self.table_directory = table_directory
+        if not os.path.exists(table_directory):
+            os.makedirs(table_directory, exist_ok=True)
+        self.segments = []
+        self.reload()
+
+    def reload(self):
+        segments = []
+        for segment_name in sorted(os.listdir(self.table_directory)):
+            segment_directory = f"{self.table_directory}/{segment_name}"
+            if not segment_name.startswith('segment_') or segment_name.endswith('.tmp'):
+                continue
+            docids = np.load(f"{segment_directory}/docids.npy", mmap_mode='r')
+            bounds = np.load(f"{segment_directory}/bounds.npy", mmap_mode='r')
+            text = np.memmap(f"{segment_directory}/text.bin", dtype=np.uint8, mode='r') \
+                if os.path.getsize(f"{segment_directory}/text.bin") > 0 else np.zeros(0, dtype=np.uint8)
+            segments.append((docids, bounds, text))
+        self.segments = segments
+
+    def _locate(self, docid):
+        for segment in self.segments:
+            docids = segment[0]
+            pos = int(np.searchsorted(docids, docid))
+            if pos < len(docids) and int(docids[pos]) == docid:
+                return segment, pos
+        return None, None
+
+    def __contains__(self, docid):
+        return self._locate(docid)[0] is not None
+
+    def get(self, docid):
+        segment, pos = self._locate(docid)
+        if segment is None:
+            raise KeyError(f"Passage {docid} is not stored in {self.table_directory}!")
+        _, bounds, text = segment
+        title_start, text_start, end = (int(x) for x in bounds[pos])
+        return text[title_start:text_start].tobytes().decode('utf-8'), text[text_start:end].tobytes().decode('utf-8')
+
+    def segment_writer(self):
+        return PassageSegmentWriter(self.table_directory)
+
+
+class PassageSegmentWriter:
+    """
+    Streams new passages into a new segment of a PassageTable, the segment is only visible to the readers once closed.
+    """
+    def __init__(self, table_directory):
+        self.segment_directory = f"{table_directory}/segment_{time.time_ns()}_{os.getpid()}"
+        self.tmp_directory = f"{self.segment_directory}.tmp"
+        os.makedirs(self.tmp_directory, exist_ok=True)
+        self.text_out = open(f"{self.tmp_directory}/text.bin", 'wb')
+        self.position = 0
+        self.bounds = dict()
+
+    def add(self, docid, title, text):
+        if docid in self.bounds:
+            return
+        encoded_title, encoded_text = title.encode('utf-8'), text.encode('utf-8')
+        self.text_out.write(encoded_title)
+        self.text_out.write(encoded_text)
+        title_start, text_start = self.position, self.position + len(encoded_title)
+        self.position = text_start + len(encoded_text)
+        self.bounds[docid] = (title_start, text_start, self.position)
+
+    def abort(self):
+        """
+        discards the segment.
+        """
+        self.text_out.close()
+        shutil.rmtree(self.tmp_directory, ignore_errors=True)
+
+    def close(self):
+        self.text_out.close()
+        if not self.bounds:
+            shutil.rmtree(self.tmp_directory)
+            return
+        docids = np.array(sorted(self.bounds), dtype=np.int64)
+        np.save(f"{self.tmp_directory}/docids.npy", docids)
+        np.save(f"{self.tmp_directory}/bounds.npy",
+                np.array([self.bounds[d] for d in docids.tolist()], dtype=np.int64).reshape(-1, 3))
+        _move_in_place(self.tmp_directory, self.segment_directory)
+
+
+class ColumnarPrefetchedCache(PrefetchedContexts):
+    """
+    How to use:
+    cache = ColumnarPrefetchedCache(f"{checkpoint_path}/cache/FACTOIDQA_dev_bm25_100.columns",
+                                    f"{checkpoint_path}/FACTOIDQA_bm25_100.zip", "data.jsonl",
+                                    PassageTable(f"{checkpoint_path}/cache/FACTOIDQA.passages"))
+    contexts = cache.read_contexts(cache.find(question), top_k=4)
+    """
+    def __init__(self, cache_directory, zip_path, member, passage_table=None):
+        """
+        the cache is built by streaming the member of the zip file (without an intermediate PrefetchedStore) if it does
+         not exist or the zip file has changed.
+        If passage_table is provided, the cache is built without inline passages and resolves them through the table.
+        """
+        self.cache_directory = cache_directory
+        source_signature = dict(_source_signature(zip_path, member), passages=passage_table is not None,
+                                version=COLUMNAR_CACHE_FORMAT_VERSION)
+        if _read_json(f"{cache_directory}/source.json") != source_signature:
+            self.build(zip_path, member, cache_directory, source_signature, passage_table)
+        self.rows = np.load(f"{cache_directory}/rows.npy", mmap_mode='r')
+        self.ids = np.load(f"{cache_directory}/ids.npy", mmap_mode='r')
+        self.string_id_bits = np.load(f"{cache_directory}/string_ids.npy", mmap_mode='r')
+        self.string_score_bits = np.load(f"{cache_directory}/string_scores.npy", mmap_mode='r')
+        self.ranks = np.load(f"{cache_directory}/ranks.npy", mmap_mode='r')
+        self.scores = np.load(f"{cache_directory}/scores.npy", mmap_mode='r')
+        self.has_answer_bits = np.load(f"{cache_directory}/has_answer.npy", mmap_mode='r')
+        self.inline_passages = os.path.exists(f"{cache_directory}/offsets.npy")
+        if self.inline_passages:
+            # the title of context i is text[offsets[2 * i]:offsets[2 * i + 1]] and its text is
+            #  text[offsets[2 * i + 1]:offsets[2 * i + 2]]
+            self.offsets = np.load(f"{cache_directory}/offsets.npy", mmap_mode='r')
+            self.text = np.memmap(f"{cache_directory}/text.bin", dtype=np.uint8, mode='r') \
+                if self.offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+        elif passage_table is None:
+            raise ValueError(f"{cache_directory} stores no passages, its dataset's PassageTable must be provided!")
+        self.passage_table = passage_table
+        self.question_index = QuestionIndex(f"{cache_directory}/questions.npy")
+
+    @staticmethod
+    def build(zip_path, member, cache_directory, source_signature, passage_table=None):
+        """
+        stores the (integer) id, rank, score and has_answer of the contexts of the member in columns, along with their
+         passages or, with a passage_table, only the passages which are not in the table yet. The ids and the scores are
+         stored with a bit marking the ones which are strings in the member, so that they are returned as they are
+         stored there.
+        In case of repeated questions, the last occurrence of the question is indexed.
+        The build fails with a ValueError (without leaving a partial cache) if the member has non integer ids.
+        """
+        print(f'Creating columnar prefetched cache {os.path.basename(cache_directory)} ...')
+        tmp_directory = f"{cache_directory}.{os.getpid()}.tmp"
+        os.makedirs(tmp_directory, exist_ok=True)
+        if passage_table is None:
+            text_out = open(f"{tmp_directory}/text.bin", 'wb')
+        else:
+            new_passages = passage_table.segment_writer()
+        try:
+            ColumnarPrefetchedCache._write_columns(
+                zip_path, member, tmp_directory, passage_table, text_out if passage_table is None else new_passages)
+        except BaseException:
+            if passage_table is None:
+                text_out.close()
+            else:
+                new_passages.abort()
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise
+        _write_json_atomically(source_signature, f"{tmp_directory}/source.json")
+        if os.path.exists(cache_directory):
+            # built from a previous version of the zip file
+            shutil.rmtree(cache_directory, ignore_errors=True)
+        _move_in_place(tmp_directory, cache_directory)
+
+    @staticmethod
+    def _integer_id(context_id, zip_path, member):
+        """
+        the context id as an integer; a string id must be the decimal form of the integer, so that it is restored as is.
+        """
+        if isinstance(context_id, int) and not isinstance(context_id, bool):
+            return context_id
+        if isinstance(context_id, str) and re.fullmatch(r"-?(0|[1-9][0-9]*)", context_id):
+            return int(context_id)
+        raise ValueError(f"{member} of {zip_path} has the non integer context id {context_id!r}, the columnar prefetched "
+                         f"cache only stores integer ids; use the PrefetchedDocumentRetriever (load_in_memory=False)!")
+
+    @staticmethod
+    def _write_columns(zip_path, member, tmp_directory, passage_table, passages_out):
+        ids, string_ids, ranks, scores, string_scores, has_answer, offsets, rows = [], [], [], [], [], [], [0], [0]
+        question_lines = dict()
+        for question_id, obj in enumerate(_prefetched_lines(zip_path, member)):
+            question_lines[question_hash(obj['question'])] = question_id
+            for context in obj['context']:
+                ids.append(ColumnarPrefetchedCache._integer_id(context['id'], zip_path, member))
+                string_ids.append(isinstance(context['id'], str))
+                ranks.append(int(context['rank']))
+                scores.append(float(context['score']))
+                string_scores.append(isinstance(context['score'], str))
+                has_answer.append(bool(context['has_answer']))
+                if passage_table is not None:
+                    if ids[-1] not in passage_table:
+                        passages_out.add(ids[-1], context['title'], context['text'])
+                    continue
+                for field in (context['title'], context['text']):
+                    encoded = field.encode('utf-8')
+                    passages_out.write(encoded)
+                    offsets.append(offsets[-1] + len(encoded))
+            rows.append(len(ids))
+        passages_out.close()
+        if passage_table is None:
+            np.save(f"{tmp_directory}/offsets.npy", np.array(offsets, dtype=np.int64))
+        else:
+            passage_table.reload()
+        np.save(f"{tmp_directory}/rows.npy", np.array(rows, dtype=np.int64))
+        np.save(f"{tmp_directory}/ids.npy", np.array(ids, dtype=np.int64))
+        np.save(f"{tmp_directory}/string_ids.npy", np.packbits(np.array(string_ids, dtype=bool)))
+        np.save(f"{tmp_directory}/ranks.npy", np.array(ranks, dtype=np.int64))
+        np.save(f"{tmp_directory}/scores.npy", np.array(scores, dtype=np.float64))
+        np.save(f"{tmp_directory}/string_scores.npy", np.packbits(np.array(string_scores, dtype=bool)))
+        np.save(f"{tmp_directory}/has_answer.npy", np.packbits(np.array(has_answer, dtype=bool)))
+        QuestionIndex.save(question_lines, f"{tmp_directory}/questions.npy")
+
+    def _field(self, position):
+        return self.text[int(self.offsets[position]):int(self.offsets[position + 1])].tobytes().decode('utf-8')
+
+    def passage(self, context_id):
+        """
+        returns the (title, text) of the context.
+        """
+        if self.inline_passages:
+            return self._field(2 * context_id), self._field(2 * context_id + 1)
+        return self.passage_table.get(int(self.ids[context_id]))
+
+    @staticmethod
+    def _bit(bits, context_id):
+        return bool((bits[context_id >> 3] >> (7 - (context_id & 7))) & 1)
+
+    def has_answer(self, context_id):
+        return self._bit(self.has_answer_bits, context_id)
+
+    def context_id(self, context_id):
+        """
+        returns the id of the context as it is stored in the prefetched archive (a string or an integer).
+        """
+        return str(self.ids[context_id]) if self._bit(self.string_id_bits, context_id) else int(self.ids[context_id])
+
+    def score(self, context_id):
+        """
+        returns the score of the context as it is stored in the prefetched archive (a string or a number).
+        """
+        score = float(self.scores[context_id])
+        return str(score) if self._bit(self.string_score_bits, context_id) else score
+
+    def read_contexts(self, question_id, top_k=None):
+        """
+        returns the first top_k (all if None) prefetched contexts of the question number in their rank order, in the
+        same format that PrefetchedStore.read_contexts returns them.
+        """
+        start, end = int(self.rows[question_id]), int(self.rows[question_id + 1])
+        if top_k is not None:
+            end = min(end, start + top_k)
+        contexts = []
+        for i in range(start, end):
+            title, text = self.passage(i)
+            contexts.append({'id': self.context_id(i), 'rank': int(self.ranks[i]), 'title': title, 'text': text,
+                             'score': self.score(i), 'has_answer': self.has_answer(i)})
+        return contexts
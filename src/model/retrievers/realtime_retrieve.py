@@ -1,6 +1,7 @@
 """
 This class is implemented to provide realtime retrieval functionality for retrieval-augmented question answering.
 """
+import os
 from typing import List, Optional, Union, Dict
 from haystack import Document
 from haystack.nodes.retriever import BaseRetriever
@@ -20,16 +21,27 @@ class RealtimeDocumentRetriever(BaseRetriever):
         super().__init__()
         self.checkpoint_path = config["Experiment"]["checkpoint_path"]
         self.retriever_type = config["Model.Retriever"]["type"].lower()
+        self.search_threads = int(config["Model.Retriever"].get("search_threads", str(os.cpu_count() or 1)))
         if self.retriever_type in ["bm25", "dpr", "ance", "dkrr"]:
             self.backend_retriever = PrefetchRetrievalDocuments(config)
-        elif self.retriever_type == "spel":
+        elif self.retriever_type in ["spel", "dict"]:
             self.backend_retriever = FetchEntityRetrievalDocuments(config)
         else:
             raise ValueError(f"Undefined retriever type: {self.retriever_type}!")
 
-    def fetch_documents(self, question: str):
-        return [RetrievedContext.convert(x).retriever_document for x in
-                self.backend_retriever.fetch_documents(question, [])]
+    def fetch_documents(self, question: str) -> List[RetrievedContext]:
+        return [RetrievedContext.convert(x) for x in self.backend_retriever.fetch_documents(question, [])]
+
+    def retrieve_passages(self, query: str, top_k: Optional[int] = None) -> List[RetrievedContext]:
+        return self.fetch_documents(query)[:top_k]
+
+    def retrieve_passages_batch(self, queries: List[str], top_k: Optional[int] = None) -> List[List[RetrievedContext]]:
+        if isinstance(self.backend_retriever, PrefetchRetrievalDocuments):
+            all_results, _ = self.backend_retriever.fetch_batch_documents([(query, []) for query in queries],
+                                                                          threads=self.search_threads)
+        else:
+            all_results, _ = self.backend_retriever.fetch_batch_documents([(query, []) for query in queries])
+        return [[RetrievedContext.convert(x) for x in results][:top_k] for results in all_results]
 
     def retrieve(self,
                  query: str,
@@ -39,7 +51,7 @@ class RealtimeDocumentRetriever(BaseRetriever):
                  headers: Optional[Dict[str, str]] = None,
                  scale_score: Optional[bool] = None,
                  document_store: Optional[BaseDocumentStore] = None) -> List[Document]:
-        return self.fetch_documents(query)[:top_k]
+        return [x.retriever_document for x in self.retrieve_passages(query, top_k)]
 
     def retrieve_batch(self,
                        queries: List[str],
@@ -50,4 +62,4 @@ class RealtimeDocumentRetriever(BaseRetriever):
                        batch_size: Optional[int] = None,
                        scale_score: Optional[bool] = None,
                        document_store: Optional[BaseDocumentStore] = None) -> List[List[Document]]:
-        return [self.fetch_documents(query)[:top_k] for query in queries]
\ No newline at end of file
+        return [[x.retriever_document for x in passages] for passages in self.retrieve_passages_batch(queries, top_k)]
\ No newline at end of file
@@ -0,0 +1,297 @@
+"""
+A compressed, seekable store of Wikipedia articles shared by the entity retrievers (SpEL and oracle entities).
+
+The articles of a `{"<identifier>": "<article text>"}` jsonl file (e.g. spel-vocab-to-wikipedia-articles.jsonl or the
+ output of get_content.py) are converted once into a store directory containing:
+ - blocks.bin: the whitespace normalized article texts, grouped into independently zlib compressed blocks,
+ - block_offsets.npy: the starting byte of each block in blocks.bin,
+ - articles.npy: the (block, start, end) location of each article inside its decompressed block,
+ - lead.bin and lead_bounds.npy: the uncompressed lead passage (first max(LEAD_WIDTHS) words) of each article and
+    the byte offsets at which its first LEAD_WIDTHS words end,
+ - keys.*: a SortedKeyIndex from the article identifiers to the article numbers,
+ - source.json: the size and modification time of the jsonl file the store is built from.
+Looking an article up is a binary search over the memory-mapped keys and the decompression of a single block; the
+ normalized article texts are kept in a byte-bounded LRU cache. The passages of the first max_w words (as used by the
+ entity retrievers) of the LEAD_WIDTHS widths are a single slice of the memory-mapped lead passages.
+"""
+import os
+import json
+import mmap
+import zlib
+import fcntl
+import shutil
+import threading
+from contextlib import contextmanager
+from itertools import accumulate
+from collections import OrderedDict
+
+import numpy as np
+from tqdm import tqdm
+
+LEAD_WIDTHS = (50, 100, 300, 1000)
+STORE_FORMAT_VERSION = 2
+
+
+class SortedKeyIndex:
+    """
+    A persistent, memory-mapped key -> int64 offset index supporting `key in index` and `index[key]`.
+    The keys are stored sorted and utf-8 encoded in a single `.keys.bin` file with their boundaries and offsets in
+     `.key_offsets.npy` and `.offsets.npy`, so loading the index does not create any Python objects per key and the
+     pages are shared between all the processes using the index.
+    """
+    def __init__(self, index_path):
+        self.key_offsets = np.load(f"{index_path}.key_offsets.npy", mmap_mode='r')
+        self.offsets = np.load(f"{index_path}.offsets.npy", mmap_mode='r')
+        self._keys_file = open(f"{index_path}.keys.bin", 'rb')
+        self.keys = mmap.mmap(self._keys_file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.path.getsize(f"{index_path}.keys.bin") else b''
+
+    @staticmethod
+    def save(key_offset_dict, index_path):
+        """
+        stores the {key: offset} dictionary as a sorted key index in index_path.* files.
+        """
+        sorted_items = sorted((k.encode('utf-8'), v) for k, v in key_offset_dict.items())
+        key_offsets = np.zeros(len(sorted_items) + 1, dtype=np.int64)
+        pid = os.getpid()
+        with open(f"{index_path}.keys.bin.{pid}.tmp", 'wb') as f:
+            for i, (k, _) in enumerate(sorted_items):
+                f.write(k)
+                key_offsets[i + 1] = key_offsets[i] + len(k)
+        offsets = np.array([v for _, v in sorted_items], dtype=np.int64)
+        with open(f"{index_path}.key_offsets.npy.{pid}.tmp", 'wb') as f:
+            np.save(f, key_offsets)
+        with open(f"{index_path}.offsets.npy.{pid}.tmp", 'wb') as f:
+            np.save(f, offsets)
+        for suffix in ['keys.bin', 'key_offsets.npy', 'offsets.npy']:
+            os.replace(f"{index_path}.{suffix}.{pid}.tmp", f"{index_path}.{suffix}")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _key(self, i):
+        return self.keys[int(self.key_offsets[i]):int(self.key_offsets[i + 1])]
+
+    def find(self, key):
+        """
+        returns the position of the key in the sorted keys (binary search over the utf-8 encoded keys) or None.
+        """
+        if not isinstance(key, str):
+            return None
+        encoded_key = key.encode('utf-8')
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            if self._key(mid) < encoded_key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < len(self) and self._key(low) == encoded_key:
+            return low
+        return None
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def __getitem__(self, key):
+        position = self.find(key)
+        if position is None:
+            raise KeyError(key)
+        return int(self.offsets[position])
+
+    def get(self, key, default=None):
+        position = self.find(key)
+        return default if position is None else int(self.offsets[position])
+
+    def __del__(self):
+        if isinstance(getattr(self, 'keys', None), mmap.mmap):
+            self.keys.close()
+        if hasattr(self, '_keys_file'):
+            self._keys_file.close()
+
+
+@contextmanager
+def _exclusive_lock(lock_path):
+    """
+    holds an exclusive lock on lock_path, serializing the processes (e.g. the prefetch workers) which build one store.
+    """
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ArticleStore:
+    """
+    How to use:
+        store = ArticleStore.open("spel-vocab-to-wikipedia-articles.jsonl", "spel-vocab-to-wikipedia-articles.store")
+        if "Albert_Einstein" in store:
+            first_100_words = store.get_first_words("Albert_Einstein", 100)
+    """
+    def __init__(self, store_directory, cache_bytes=256 * 1024 * 1024):
+        self.store_directory = store_directory
+        self.index = SortedKeyIndex(os.path.join(store_directory, "keys"))
+        self.block_offsets = np.load(os.path.join(store_directory, "block_offsets.npy"), mmap_mode='r')
+        self.articles = np.load(os.path.join(store_directory, "articles.npy"), mmap_mode='r')
+        blocks_path = os.path.join(store_directory, "blocks.bin")
+        self._blocks_file = open(blocks_path, 'rb')
+        self.blocks = mmap.mmap(self._blocks_file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.path.getsize(blocks_path) else b''
+        self.lead_bounds = np.load(os.path.join(store_directory, "lead_bounds.npy"), mmap_mode='r')
+        lead_path = os.path.join(store_directory, "lead.bin")
+        self._lead_file = open(lead_path, 'rb')
+        self.lead = mmap.mmap(self._lead_file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.path.getsize(lead_path) else b''
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _source_signature(jsonl_path):
+        stat = os.stat(jsonl_path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'version': STORE_FORMAT_VERSION,
+                'lead_widths': list(LEAD_WIDTHS)}
+
+    @staticmethod
+    def is_valid(jsonl_path, store_directory):
+        source_path = os.path.join(store_directory, "source.json")
+        if not os.path.exists(source_path):
+            return False
+        with open(source_path, 'r') as f:
+            return json.load(f) == ArticleStore._source_signature(jsonl_path)
+
+    @classmethod
+    def open(cls, jsonl_path, store_directory, key_transform=None, **kwargs):
+        """
+        opens the store of the jsonl file, building it first if it does not exist or the jsonl file has changed. The
+         processes opening the same store concurrently wait for the one building it instead of building it again.
+        """
+        if not cls.is_valid(jsonl_path, store_directory):
+            with _exclusive_lock(f"{store_directory.rstrip(os.sep)}.lock"):
+                if not cls.is_valid(jsonl_path, store_directory):
+                    cls.build(jsonl_path, store_directory, key_transform)
+        return cls(store_directory, **kwargs)
+
+    @staticmethod
+    def build(jsonl_path, store_directory, key_transform=None, block_size=64 * 1024):
+        """
+        converts the {identifier: article} lines of the jsonl file into a store. The identifiers are passed through
+        key_transform (if given) and, as with a dictionary, the last line of a repeated identifier is kept.
+        """
+        print(f'Converting {os.path.basename(jsonl_path)} into a compressed article store ...')
+        tmp_directory = f"{store_directory.rstrip(os.sep)}.{os.getpid()}.tmp"
+        os.makedirs(tmp_directory, exist_ok=True)
+        keys = dict()
+        articles = []
+        block_offsets = [0]
+        block = bytearray()
+        lead_bounds = []
+        lead_length = 0
+        with open(jsonl_path, 'rb') as fh, open(os.path.join(tmp_directory, "blocks.bin"), 'wb') as out, \
+                open(os.path.join(tmp_directory, "lead.bin"), 'wb') as lead_out:
+            def flush_block():
+                compressed = zlib.compress(bytes(block), 6)
+                out.write(compressed)
+                block_offsets.append(block_offsets[-1] + len(compressed))
+                block.clear()
+
+            for line in tqdm(fh):
+                if not line.strip():
+                    continue
+                key, article = next(iter(json.loads(line).items()))
+                if key_transform is not None:
+                    key = key_transform(key)
+                words = article.split()
+                text = " ".join(words).encode('utf-8')
+                # the byte length of the first n words (and the n - 1 spaces between them)
+                lead_word_ends = list(accumulate(len(w.encode('utf-8')) + 1 for w in words[:LEAD_WIDTHS[-1]]))
+                bounds = [lead_length]
+                for width in LEAD_WIDTHS:
+                    bounds.append(lead_length + (lead_word_ends[min(width, len(lead_word_ends)) - 1] - 1
+                                                 if lead_word_ends else 0))
+                lead_out.write(text[:bounds[-1] - lead_length])
+                lead_length = bounds[-1]
+                lead_bounds.append(bounds)
+                keys[key] = len(articles)
+                articles.append((len(block_offsets) - 1, len(block), len(block) + len(text)))
+                block.extend(text)
+                if len(block) >= block_size:
+                    flush_block()
+            if block:
+                flush_block()
+        np.save(os.path.join(tmp_directory, "block_offsets.npy"), np.array(block_offsets, dtype=np.int64))
+        np.save(os.path.join(tmp_directory, "articles.npy"), np.array(articles, dtype=np.int64).reshape(-1, 3))
+        np.save(os.path.join(tmp_directory, "lead_bounds.npy"),
+                np.array(lead_bounds, dtype=np.int64).reshape(-1, len(LEAD_WIDTHS) + 1))
+        SortedKeyIndex.save(keys, os.path.join(tmp_directory, "keys"))
+        with open(os.path.join(tmp_directory, "source.json"), 'w') as f:
+            json.dump(ArticleStore._source_signature(jsonl_path), f)
+        if ArticleStore.is_valid(jsonl_path, store_directory):
+            # another process has built the same store in the meantime
+            shutil.rmtree(tmp_directory)
+            return
+        if os.path.exists(store_directory):
+            shutil.rmtree(store_directory)
+        os.replace(tmp_directory, store_directory)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def _read_article(self, article_id):
+        block_id, start, end = (int(x) for x in self.articles[article_id])
+        block = zlib.decompress(self.blocks[int(self.block_offsets[block_id]):int(self.block_offsets[block_id + 1])])
+        return block[start:end].decode('utf-8')
+
+    def get(self, key):
+        """
+        returns the whitespace normalized text of the article ('' if the key is not in the store).
+        """
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        article_id = self.index.get(key)
+        if article_id is None:
+            return ''
+        text = self._read_article(article_id)
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = text
+                self._cached_bytes += len(text)
+                while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_bytes -= len(evicted)
+        return text
+
+    def get_first_words(self, key, max_w):
+        """
+        returns the first max_w words of the article ('' if the key is not in the store). For the LEAD_WIDTHS widths
+        this is a single slice of the lead passages, other widths up to max(LEAD_WIDTHS) split a lead passage and the
+        longer ones read the whole article.
+        """
+        if max_w > LEAD_WIDTHS[-1]:
+            return " ".join(self.get(key).split(" ", max_w)[:max_w])
+        article_id = self.index.get(key)
+        if article_id is None:
+            return ''
+        bounds = self.lead_bounds[article_id]
+        for width_id, width in enumerate(LEAD_WIDTHS):
+            if width >= max_w:
+                lead_passage = self.lead[int(bounds[0]):int(bounds[width_id + 1])].decode('utf-8')
+                return lead_passage if width == max_w else " ".join(lead_passage.split(" ", max_w)[:max_w])
+
+    def __del__(self):
+        if isinstance(getattr(self, 'blocks', None), mmap.mmap):
+            self.blocks.close()
+        if hasattr(self, '_blocks_file'):
+            self._blocks_file.close()
+        if isinstance(getattr(self, 'lead', None), mmap.mmap):
+            self.lead.close()
+        if hasattr(self, '_lead_file'):
+            self._lead_file.close()
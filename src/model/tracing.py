@@ -0,0 +1,125 @@
+"""
+Lightweight per-stage latency tracing of the annotation runs.
+
+The stages of the annotation loop (dataset read, entity linking, retrieval search, document fetch, prompt build,
+ tokenization, prefill, decode and store) are wrapped in named spans. The tracer is disabled by default and a span
+ costs a single attribute check until it is enabled through Experiment.trace_path; once enabled, the spans are
+ exported at the end of the run either as JSON-lines (one span per line) or, for paths ending in `.json`, as a Chrome
+ trace (loadable in chrome://tracing or https://ui.perfetto.dev), and the p50/p95/p99 latency of each stage is printed.
+
+How to use:
+    from model.tracing import TRACER
+    TRACER.enable("trace.json")
+    with TRACER.span("retrieval_search", records=len(questions)):
+        ...
+    TRACER.close()
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def enable(self, path):
+        self.enabled = True
+        self.path = path
+        self.spans = []
+
+    @staticmethod
+    def now():
+        return time.perf_counter_ns()
+
+    def add(self, name, start_ns, end_ns, **args):
+        """
+        records a span measured by the caller (e.g. the prefill and decode spans which are split inside generate).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.spans.append((name, start_ns, end_ns, threading.get_ident(), args))
+
+    @contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        start_ns = self.now()
+        try:
+            yield
+        finally:
+            self.add(name, start_ns, self.now(), **args)
+
+    def traced_iter(self, name, iterable):
+        """
+        yields the items of iterable, recording the time spent in producing each of them as a span.
+        """
+        iterator = iter(iterable)
+        while True:
+            start_ns = self.now()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(name, start_ns, self.now())
+            yield item
+
+    def summary(self):
+        """
+        the count, mean and p50/p95/p99 latencies (in milliseconds) of the spans of each stage.
+        """
+        durations = {}
+        for name, start_ns, end_ns, _, _ in self.spans:
+            durations.setdefault(name, []).append((end_ns - start_ns) / 1e6)
+        result = {}
+        for name, values in durations.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[name] = {"count": len(values), "mean": float(np.mean(values)), "p50": float(p50),
+                            "p95": float(p95), "p99": float(p99), "total": float(np.sum(values))}
+        return result
+
+    def print_summary(self):
+        print('\t'+'='*78)
+        print(f'\t{"stage":<20}{"count":>8}{"mean ms":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"total s":>10}')
+        print('\t'+'='*78)
+        for name, s in sorted(self.summary().items(), key=lambda x: -x[1]["total"]):
+            print(f'\t{name:<20}{s["count"]:>8}{s["mean"]:>10.2f}{s["p50"]:>10.2f}{s["p95"]:>10.2f}'
+                  f'{s["p99"]:>10.2f}{s["total"] / 1000:>10.2f}')
+        print('\t'+'='*78)
+
+    def export(self):
+        if self.path.endswith(".json"):
+            pid = os.getpid()
+            events = [{"name": name, "ph": "X", "ts": start_ns / 1000, "dur": (end_ns - start_ns) / 1000,
+                       "pid": pid, "tid": tid, "args": args}
+                      for name, start_ns, end_ns, tid, args in self.spans]
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        else:
+            with open(self.path, "w", encoding="utf-8") as f:
+                for name, start_ns, end_ns, tid, args in self.spans:
+                    f.write(json.dumps({"name": name, "start_us": start_ns / 1000,
+                                        "duration_us": (end_ns - start_ns) / 1000, "thread": tid, "args": args}) + "\n")
+
+    def close(self):
+        """
+        exports the recorded spans and prints the latency summary of the stages.
+        """
+        if not self.enabled:
+            return
+        self.export()
+        print(f"Stored {len(self.spans)} trace spans in {self.path}")
+        self.print_summary()
+        self.enabled = False
+
+
+TRACER = Tracer()
@@ -1,7 +1,52 @@
+from model.retrievers.loader import get_retriever
+
 
 class LLMModel:
     """
     Used to unify the different LLM class implementations.
     """
     def annotate(self, record, summarize=False, verbose=False):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    @staticmethod
+    def _retriever_key_of(config):
+        """
+        identifies the retriever of config["Model.Retriever"], which does not depend on its top_k.
+        """
+        return tuple(sorted((k, str(v)) for k, v in config["Model.Retriever"].items() if k != 'retriever_top_k'))
+
+    def set_retriever(self, config):
+        """
+        Replaces the retriever of the loaded model with the one in config["Model.Retriever"] (used by the experiment
+         sweeps of main.py to reuse the model); the retriever is only reloaded when more than its top_k has changed.
+        """
+        retriever_key = self._retriever_key_of(config)
+        self.config = config
+        self.retriever_type = config["Model.Retriever"]["type"]
+        self.use_retriever = self.retriever_type.lower() != 'none'
+        self.top_k = int(config["Model.Retriever"]["retriever_top_k"]) if self.use_retriever else 0
+        if retriever_key != getattr(self, '_retriever_key', None):
+            self._retriever = None
+            self._retriever = get_retriever(config)
+            self._retriever_key = retriever_key
+
+    def annotate_batch(self, records, summarize=False, verbose=False):
+        """
+        Annotates a list of records; the implementations which can generate for a batch of prompts at once override this.
+        """
+        for record in records:
+            self.annotate(record, summarize=summarize, verbose=verbose)
+
+    def prepare_batch(self, records, summarize=False, verbose=False):
+        """
+        Performs the generation-independent part of annotating the records (e.g. retrieval and prompt construction).
+        The returned value is passed to complete_batch, and this method may be called on a background thread while the
+         previous batch is being completed; the default implementation leaves all the work to complete_batch.
+        """
+        return None
+
+    def complete_batch(self, records, prepared, summarize=False, verbose=False):
+        """
+        Completes the annotation of the records using the output of prepare_batch.
+        """
+        self.annotate_batch(records, summarize=summarize, verbose=verbose)
\ No newline at end of file
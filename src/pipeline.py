@@ -0,0 +1,137 @@
+"""
+A staged annotation pipeline which overlaps reading the dataset, retrieval/prompt construction, generation and storing
+ the results. Each stage runs on its own thread and hands its batches to the next stage through a bounded queue:
+ - the reader thread iterates over the dataset and groups the records into batches,
+ - the prepare thread calls LLMModel.prepare_batch (retrieval and prompt construction) for the upcoming batches,
+ - the calling thread calls LLMModel.complete_batch (generation) for the current batch,
+ - the writer thread hands the annotated batches to the on_annotated callback (e.g. metrics and StoreResult).
+The prepare and the generation stages swap threads with prepare_on_main_thread (see AnnotationPipeline).
+Every stage processes the batches in the order it receives them, so the output order is the order of the dataset.
+"""
+import queue
+import threading
+
+_END = object()
+
+
+class _StageFailure:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def batched(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _drain(source_queue):
+    while True:
+        item = source_queue.get()
+        if item is _END:
+            return
+        if isinstance(item, _StageFailure):
+            raise item.exception
+        yield item
+
+
+def _run_stage(source, target_queue, function):
+    try:
+        for item in source:
+            target_queue.put(function(item))
+    except BaseException as e:
+        target_queue.put(_StageFailure(e))
+        return
+    target_queue.put(_END)
+
+
+class AnnotationPipeline:
+    """
+    With prepare_on_main_thread set, the calling thread prepares the batches and a generation thread completes them
+     instead, for the retrievers which can only run on the main thread (the realtime SpEL linker times its subword to
+     word mapping out with signals, which are only delivered to the main thread).
+
+    How to use:
+        pipeline = AnnotationPipeline(llm, batch_size=8, queue_size=2)
+        pipeline.run(dataset, lambda batch: [output.store(record) for record in batch])
+    """
+    def __init__(self, llm, batch_size=1, queue_size=2, summarize=False, verbose=False, prepare_on_main_thread=False):
+        self.llm = llm
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.summarize = summarize
+        self.verbose = verbose
+        self.prepare_on_main_thread = prepare_on_main_thread
+
+    def _prepare(self, batch):
+        return batch, self.llm.prepare_batch(batch, summarize=self.summarize, verbose=self.verbose)
+
+    def _complete(self, batch, prepared):
+        self.llm.complete_batch(batch, prepared, summarize=self.summarize, verbose=self.verbose)
+
+    def run(self, dataset, on_annotated):
+        """
+        annotates all the records of the dataset and calls on_annotated (on the writer thread) with each annotated batch.
+        """
+        read_queue = queue.Queue(maxsize=self.queue_size)
+        prepared_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        failures = []
+
+        def consume(source_queue, function):
+            try:
+                for item in _drain(source_queue):
+                    if failures:
+                        continue  # keep draining so that the stage feeding the queue is never blocked on a full queue
+                    try:
+                        function(item)
+                    except BaseException as e:
+                        failures.append(e)
+            except BaseException as e:
+                failures.append(e)
+
+        def complete(item):
+            self._complete(*item)
+            write_queue.put(item[0])
+
+        def complete_all():
+            consume(prepared_queue, complete)
+            write_queue.put(_END)
+
+        reader = threading.Thread(target=_run_stage, args=(batched(dataset, self.batch_size), read_queue, lambda b: b),
+                                  daemon=True)
+        writer = threading.Thread(target=consume, args=(write_queue, on_annotated), daemon=True)
+        if self.prepare_on_main_thread:
+            completer = threading.Thread(target=complete_all, daemon=True)
+            for thread in (reader, completer, writer):
+                thread.start()
+            try:
+                for batch in _drain(read_queue):
+                    if failures:
+                        break
+                    prepared_queue.put(self._prepare(batch))
+            finally:
+                prepared_queue.put(_END)
+                completer.join()
+                writer.join()
+        else:
+            preparer = threading.Thread(target=_run_stage, args=(_drain(read_queue), prepared_queue, self._prepare),
+                                        daemon=True)
+            for thread in (reader, preparer, writer):
+                thread.start()
+            try:
+                for batch, prepared in _drain(prepared_queue):
+                    if failures:
+                        break
+                    self._complete(batch, prepared)
+                    write_queue.put(batch)
+            finally:
+                write_queue.put(_END)
+                writer.join()
+        if failures:
+            raise failures[0]
@@ -2,6 +2,11 @@ datasets=('FACTOIDQA' 'STRATEGYQA' 'EntityQuestions')
 splits=('train' 'dev' 'test')
 types=('spel')
 k=100
+# one entity linker (a RoBERTa-large model) is loaded per worker process, so only a few workers are started by default.
+# the number of shards is fixed (independent of the number of workers and the host) so that a rerun, which skips the
+#  shards completed by a previous run, splits the questions into the same shards.
+workers=${WORKERS:-2}
+shards=${SHARDS:-16}
 echo 'roberta-large' > base_model.cfg
 
 for dataset in "${datasets[@]}"; do
@@ -17,7 +22,7 @@ for dataset in "${datasets[@]}"; do
             continue
           fi
           output_file="prefetched_entity_retrieval_${dataset}_${split}_${type}_${k}.jsonl"
-          python model/retrievers/prefetch_retrieval_entity_linking.py --dataset "$dataset" --split "$split" --type "$type" --max_w "$k" --output_file "$output_file"
+          python model/retrievers/prefetch_retrieval_entity_linking.py --dataset "$dataset" --split "$split" --type "$type" --max_w "$k" --output_file "$output_file" --num_workers "$workers" --num_shards "$shards"
         done
     done
 done